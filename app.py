@@ -1,12 +1,49 @@
-from flask import Flask, render_template, request, send_file, jsonify
+from flask import Flask, render_template, request, send_file, jsonify, Response, stream_with_context, g, has_request_context
 import yfinance as yf
+from yfinance.exceptions import YFRateLimitError
+
+try:
+    import fcntl
+except ImportError:  # Windows: the cache is then only shared between threads
+    fcntl = None
 import pandas as pd
 import numpy as np
 import json
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from functools import lru_cache
+import atexit
+import bisect
+import click
+import cProfile
+import csv
+import difflib
+import hashlib
+import heapq
+import hmac
 import io
+import itertools
+import marshal
+import mmap
 import os
+import pickle
+import pstats
+import random
+import re
+import sqlite3
+import struct
+import threading
+import time
+import tracemalloc
+import zlib
+import matplotlib
+matplotlib.use('Agg')  # Server-side rendering, no display
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from datetime import datetime, timedelta
+from numpy.lib.stride_tricks import sliding_window_view
 import plotly
 import plotly.express as px
 import plotly.graph_objects as go
@@ -17,6 +54,9 @@ from docx.enum.style import WD_STYLE_TYPE
 
 app = Flask(__name__)
 
+# Directory for locally persisted data (ratio table, caches, stores)
+DATA_DIR = os.environ.get('DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+
 # Define sample companies - Added 10 more including Intel
 companies = {
     "AAPL": "Apple Inc.",
@@ -65,10 +105,174 @@ company_descriptions = {
     "CVX": "Chevron Corporation engages in integrated energy and chemicals operations worldwide. The company operates through Upstream and Downstream segments, involved in exploration, production, refining, marketing, and transportation of oil and gas."
 }
 
+# Optional local file with the full company universe: one "symbol,name,description"
+# CSV record per line (header optional, description optional, no embedded newlines)
+company_file = os.environ.get('COMPANY_FILE', os.path.join(DATA_DIR, 'companies.csv'))
+
+# Registry of every known company symbol. The built-in companies above are always
+# present; a universe file adds tens of thousands more. Only symbols and names are
+# kept in memory (in sorted arrays for prefix search); descriptions are read from
+# the file on demand using each record's byte offset.
+class CompanyRegistry:
+    def __init__(self, builtin_names, builtin_descriptions, path=None):
+        self.builtin_names = builtin_names
+        self.builtin_descriptions = builtin_descriptions
+        self.path = path
+        self.loaded = False
+        self.load_lock = threading.Lock()
+        self.symbols = []   # sorted upper-case symbols
+        self.names = []     # names parallel to symbols
+        self.offsets = []   # byte offset of each symbol's record in the file (-1 for built-ins)
+        self.words = []     # sorted (lower-case name word, symbol position) pairs
+    
+    def ensure_loaded(self):
+        if self.loaded:
+            return
+        with self.load_lock:
+            if self.loaded:
+                return
+            
+            entries = {symbol.upper(): (name, -1) for symbol, name in self.builtin_names.items()}
+            if self.path and os.path.exists(self.path):
+                with open(self.path, 'rb') as f:
+                    offset = 0
+                    for line in f:
+                        record = next(csv.reader([line.decode('utf-8', errors='replace')]), [])
+                        if len(record) >= 2 and record[0].strip() and record[0].strip().lower() != 'symbol':
+                            symbol = record[0].strip().upper()
+                            # Built-in names win, but the file may still supply a description
+                            name = entries[symbol][0] if symbol in entries else record[1].strip()
+                            entries[symbol] = (name, offset)
+                        offset += len(line)
+            
+            symbols = sorted(entries)
+            self.names = [entries[symbol][0] for symbol in symbols]
+            self.offsets = np.array([entries[symbol][1] for symbol in symbols], dtype=np.int64)
+            self.words = sorted((word, i) for i, name in enumerate(self.names)
+                                for word in re.findall(r'[a-z0-9]+', name.lower()))
+            self.symbols = symbols
+            self.loaded = True
+    
+    def __len__(self):
+        self.ensure_loaded()
+        return len(self.symbols)
+    
+    def __contains__(self, symbol):
+        return self.position(symbol) is not None
+    
+    def position(self, symbol):
+        self.ensure_loaded()
+        symbol = (symbol or '').upper()
+        i = bisect.bisect_left(self.symbols, symbol)
+        return i if i < len(self.symbols) and self.symbols[i] == symbol else None
+    
+    # Company name for a symbol, or None for unknown symbols
+    def name(self, symbol):
+        i = self.position(symbol)
+        return self.names[i] if i is not None else None
+    
+    # Company description, loaded lazily from the universe file
+    def description(self, symbol):
+        symbol = (symbol or '').upper()
+        if symbol in self.builtin_descriptions:
+            return self.builtin_descriptions[symbol]
+        i = self.position(symbol)
+        if i is None or self.offsets[i] < 0:
+            return None
+        return self._read_description(int(self.offsets[i]))
+    
+    @lru_cache(maxsize=1024)
+    def _read_description(self, offset):
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            record = next(csv.reader([f.readline().decode('utf-8', errors='replace')]), [])
+        return record[2].strip() if len(record) > 2 and record[2].strip() else None
+    
+    # Autocomplete: symbol prefix matches first, then name word prefixes,
+    # then close (fuzzy) symbol matches among symbols with the same first letter
+    def search(self, query, limit=10):
+        self.ensure_loaded()
+        query = (query or '').strip()
+        if not query:
+            return []
+        
+        found = []
+        seen = set()
+        
+        def add(i):
+            if i not in seen and len(found) < limit:
+                seen.add(i)
+                found.append(i)
+        
+        prefix = query.upper()
+        i = bisect.bisect_left(self.symbols, prefix)
+        while i < len(self.symbols) and self.symbols[i].startswith(prefix) and len(found) < limit:
+            add(i)
+            i += 1
+        
+        terms = re.findall(r'[a-z0-9]+', query.lower())
+        if terms and len(found) < limit:
+            j = bisect.bisect_left(self.words, (terms[0], -1))
+            while j < len(self.words) and self.words[j][0].startswith(terms[0]) and len(found) < limit:
+                position = self.words[j][1]
+                # Remaining query words must also appear in the name
+                if all(term in self.names[position].lower() for term in terms[1:]):
+                    add(position)
+                j += 1
+        
+        if len(found) < limit:
+            start = bisect.bisect_left(self.symbols, prefix[:1])
+            end = bisect.bisect_left(self.symbols, prefix[:1] + '\uffff')
+            for match in difflib.get_close_matches(prefix, self.symbols[start:end], n=limit, cutoff=0.6):
+                add(self.position(match))
+        
+        return [{'symbol': self.symbols[i], 'name': self.names[i]} for i in found]
+
+company_registry = CompanyRegistry(companies, company_descriptions, company_file)
+
 @app.route('/')
 def index():
+    # Only the built-in companies are rendered; the rest of the universe is reached via search
     return render_template('index.html', companies=companies)
 
+@app.route('/companies/search')
+def company_search():
+    # A non-numeric limit falls back to the default; the result is kept within 1..50
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    return jsonify({'results': company_registry.search(request.args.get('q', ''), limit)})
+
+@app.route('/companies/<symbol>')
+def company_details(symbol):
+    name = company_registry.name(symbol)
+    if name is None:
+        return jsonify({'error': f'Unknown symbol: {symbol}'}), 404
+    return jsonify({'symbol': symbol.upper(), 'name': name, 'description': company_registry.description(symbol)})
+
+# Alternative row names for the statement line items used by the metrics
+row_aliases = {
+    'Current Assets': ['Total Current Assets', 'CurrentAssets', 'Current Assets', 'TotalCurrentAssets'],
+    'Current Liabilities': ['Total Current Liabilities', 'CurrentLiabilities', 'Current Liabilities', 'TotalCurrentLiabilities'],
+    'Revenue': ['Total Revenue', 'Revenue', 'TotalRevenue', 'Gross Revenue', 'Sales'],
+    'Net Income': ['Net Income', 'NetIncome', 'Net Income Common Stockholders', 'Net Income From Continuing Operations', 'NetIncomeCommonStockholders'],
+    'Total Assets': ['Total Assets', 'TotalAssets', 'Assets'],
+    'Stockholder Equity': ['Total Stockholder Equity', 'StockholderEquity', 'Stockholders Equity', 'Total Shareholders Equity', 'Shareholders Equity', 'TotalStockholderEquity', 'TotalShareholdersEquity'],
+    'Inventory': ['Inventory', 'Inventories', 'Total Inventory', 'TotalInventory'],
+    'Accounts Receivable': ['Net Receivables', 'Accounts Receivable', 'AccountsReceivable', 'Total Receivables', 'TotalReceivables', 'NetReceivables'],
+    'Total Liabilities': ['Total Liabilities', 'TotalLiabilities', 'Liabilities'],
+    'EBIT': ['EBIT', 'Operating Income', 'OperatingIncome', 'Income Before Tax', 'IncomeBeforeTax'],
+    'Interest Expense': ['Interest Expense', 'InterestExpense'],
+    'Income Tax': ['Income Tax Expense', 'IncomeTaxExpense', 'Tax Provision', 'Provision for Income Taxes', 'ProvisionForIncomeTaxes'],
+    'Shares Outstanding': ['Ordinary Shares Number', 'Share Issued', 'OrdinarySharesNumber', 'ShareIssued'],
+    'Total Debt': ['Total Debt', 'TotalDebt'],
+    'Cash': ['Cash And Cash Equivalents', 'CashAndCashEquivalents', 'Cash Cash Equivalents And Short Term Investments'],
+    'EBITDA': ['EBITDA', 'Normalized EBITDA', 'NormalizedEBITDA'],
+    'Depreciation And Amortization': ['Depreciation And Amortization', 'Reconciled Depreciation', 'DepreciationAndAmortization'],
+    'Net Interest Income': ['Net Interest Income', 'NetInterestIncome'],
+    'Non Interest Expense': ['Non Interest Expense', 'NonInterestExpense', 'Noninterest Expense'],
+    'Net Loans': ['Net Loan', 'Net Loans', 'NetLoan', 'Loans Receivable', 'Gross Loan'],
+    'Total Deposits': ['Total Deposits', 'TotalDeposits', 'Deposits']
+}
+
 # Helper function to find the closest matching row
 def find_row(df, possible_names):
     for name in possible_names:
@@ -90,344 +294,1202 @@ def format_number(num):
     else:
         return f"${num:.2f}"
 
-# Function to calculate financial metrics
-def calculate_metrics(ticker, years_back=5):
+# Industry averages (placeholder - in a real app, this would come from a database)
+industry_averages = {
+    'Current Ratio': 1.5,
+    'Quick Ratio': 1.0,
+    'Current Asset Turnover': 2.0,
+    'Total Asset Turnover': 0.9,
+    'Days Sales Outstanding': 40.0,
+    'Profit Margin': 0.15,
+    'Debt Ratio': 0.5,
+    'Return on Equity': 0.2,
+    'Basic Earning Power': 0.25
+}
+
+# Ratios produced by calculate_metrics, in display order
+metric_names = list(industry_averages.keys())
+
+# Sector metric packs, chosen from the company's .info sector and industry.
+# 'required' lists the row_aliases items that must be present before any ratio is
+# computed; 'not_applicable' core ratios are shown as N/A instead of being zero-filled;
+# 'metrics' maps each sector ratio to (numerator, denominator, averaged denominator);
+# a sector ratio whose items are not reported is shown as N/A. Only require items
+# Yahoo actually reports for the sector (e.g. it has no deposits or total
+# non-interest expense rows for banks).
+metric_packs = {
+    'General': {
+        'sectors': [],
+        'industries': [],
+        'required': ['Current Assets', 'Current Liabilities', 'Revenue', 'Net Income', 'Total Assets', 'Stockholder Equity'],
+        'not_applicable': [],
+        'metrics': {},
+        'benchmarks': {},
+        'formulas': {}
+    },
+    'Banking': {
+        'sectors': ['Financial Services'],
+        'industries': ['Banks'],
+        'required': ['Revenue', 'Net Income', 'Total Assets', 'Stockholder Equity', 'Net Interest Income', 'Net Loans'],
+        'not_applicable': ['Current Ratio', 'Quick Ratio', 'Current Asset Turnover', 'Days Sales Outstanding'],
+        'metrics': {
+            'Net Interest Margin': ('Net Interest Income', 'Total Assets', True),
+            'Efficiency Ratio': ('Non Interest Expense', 'Revenue', False),
+            'Loan/Deposit Ratio': ('Net Loans', 'Total Deposits', False),
+            'Equity/Assets': ('Stockholder Equity', 'Total Assets', False)
+        },
+        'benchmarks': {
+            'Net Interest Margin': 0.03,
+            'Efficiency Ratio': 0.6,
+            'Loan/Deposit Ratio': 0.8,
+            'Equity/Assets': 0.1
+        },
+        'formulas': {
+            'Net Interest Margin': 'Net Interest Income / Average Total Assets',
+            'Efficiency Ratio': 'Non-Interest Expense / Revenue',
+            'Loan/Deposit Ratio': 'Net Loans / Total Deposits',
+            'Equity/Assets': "Shareholders' Equity / Total Assets"
+        }
+    }
+}
+
+# Helper function to convert statement columns from timestamps to string dates
+def format_statement_columns(df):
+    df.columns = [col.strftime('%Y-%m-%d') if hasattr(col, 'strftime') else col for col in df.columns]
+    return df
+
+# Upstream client settings (requests per second, burst size, retries, circuit breaker)
+upstream_rate = float(os.environ.get('YAHOO_RATE_LIMIT', 2.0))
+upstream_burst = int(os.environ.get('YAHOO_BURST', 5))
+upstream_retries = int(os.environ.get('YAHOO_RETRIES', 3))
+upstream_failure_threshold = int(os.environ.get('YAHOO_FAILURE_THRESHOLD', 5))
+upstream_reset_timeout = float(os.environ.get('YAHOO_RESET_TIMEOUT', 60))
+
+# Raised when Yahoo is unhealthy and there is no cached data to fall back on
+class UpstreamUnavailable(Exception):
+    pass
+
+# Token bucket rate limiter shared by every thread calling Yahoo
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    # Block until a token is available
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+# Circuit breaker: opens after consecutive failures, then lets a single trial
+# request through once the reset timeout has passed (half-open)
+class CircuitBreaker:
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+    
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+    
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+    
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+    
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+# Helper function to decide whether an upstream error is worth retrying
+# Status codes in messages only count when tied to HTTP, so symbols such as 6502.T do not match
+http_status_pattern = re.compile(r'\b(?:http(?: error)?|status(?: code)?)\W{0,3}(429|5\d\d)\b')
+
+def is_transient_error(error):
+    if isinstance(error, (YFRateLimitError, ConnectionError, TimeoutError)):
+        return True
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    message = str(error).lower()
+    return bool(http_status_pattern.search(message)) or any(marker in message for marker in (
+        'too many requests', 'rate limit', 'timed out', 'timeout', 'temporarily unavailable',
+        'connection reset', 'connection refused', 'connection aborted', 'failed to establish a new connection'
+    ))
+
+# Helper function to create the pooled keep-alive HTTP session used for Yahoo
+def create_upstream_session():
     try:
-        # Get financial data
-        company = yf.Ticker(ticker)
-        
-        # Get company info
-        company_info = company.info
-        
-        # Get balance sheet, income statement, and cash flow data
-        balance_sheet = company.balance_sheet
-        income_stmt = company.income_stmt
-        cash_flow = company.cashflow
-        
-        # Convert column names from timestamps to string dates for better display
-        balance_sheet.columns = [col.strftime('%Y-%m-%d') if hasattr(col, 'strftime') else col for col in balance_sheet.columns]
-        income_stmt.columns = [col.strftime('%Y-%m-%d') if hasattr(col, 'strftime') else col for col in income_stmt.columns]
-        cash_flow.columns = [col.strftime('%Y-%m-%d') if hasattr(col, 'strftime') else col for col in cash_flow.columns]
-        
-        # Get common dates across all statements
-        common_dates = sorted(set(balance_sheet.columns).intersection(set(income_stmt.columns)), reverse=True)
-        
-        # Limit to requested years
-        common_dates = common_dates[:min(years_back, len(common_dates))]
-        
-        # Filter to common dates
-        balance_sheet = balance_sheet[common_dates]
-        income_stmt = income_stmt[common_dates]
-        cash_flow = cash_flow[common_dates]
-        
-        # Create a metrics dataframe
-        metrics = pd.DataFrame(index=common_dates)
-        
-        # Find key financial rows with alternative names
-        # Current Assets
-        current_assets = find_row(balance_sheet, [
-            'Total Current Assets', 
-            'CurrentAssets', 
-            'Current Assets',
-            'TotalCurrentAssets'
-        ])
-        if current_assets is None:
-            # Debug print balance sheet rows
-            return None, None, None, None, f"Could not find Current Assets in balance sheet. Available rows: {', '.join(balance_sheet.index)}"
-        
-        # Current Liabilities
-        current_liabilities = find_row(balance_sheet, [
-            'Total Current Liabilities', 
-            'CurrentLiabilities', 
-            'Current Liabilities',
-            'TotalCurrentLiabilities'
-        ])
-        if current_liabilities is None:
-            return None, None, None, None, f"Could not find Current Liabilities in balance sheet. Available rows: {', '.join(balance_sheet.index)}"
-        
-        # Revenue
-        revenue = find_row(income_stmt, [
-            'Total Revenue', 
-            'Revenue', 
-            'TotalRevenue',
-            'Gross Revenue',
-            'Sales'
-        ])
-        if revenue is None:
-            return None, None, None, None, f"Could not find Revenue in income statement. Available rows: {', '.join(income_stmt.index)}"
-        
-        # Net Income
-        net_income = find_row(income_stmt, [
-            'Net Income', 
-            'NetIncome', 
-            'Net Income Common Stockholders',
-            'Net Income From Continuing Operations',
-            'NetIncomeCommonStockholders'
-        ])
-        if net_income is None:
-            return None, None, None, None, f"Could not find Net Income in income statement. Available rows: {', '.join(income_stmt.index)}"
-        
-        # Total Assets
-        total_assets = find_row(balance_sheet, [
-            'Total Assets', 
-            'TotalAssets', 
-            'Assets'
-        ])
-        if total_assets is None:
-            return None, None, None, None, f"Could not find Total Assets in balance sheet. Available rows: {', '.join(balance_sheet.index)}"
-        
-        # Stockholder Equity
-        shareholder_equity = find_row(balance_sheet, [
-            'Total Stockholder Equity', 
-            'StockholderEquity', 
-            'Stockholders Equity',
-            'Total Shareholders Equity',
-            'Shareholders Equity',
-            'TotalStockholderEquity',
-            'TotalShareholdersEquity'
-        ])
-        if shareholder_equity is None:
-            return None, None, None, None, f"Could not find Stockholder Equity in balance sheet. Available rows: {', '.join(balance_sheet.index)}"
-        
-        # Inventory (Optional)
-        inventory = find_row(balance_sheet, [
-            'Inventory', 
-            'Inventories', 
-            'Total Inventory',
-            'TotalInventory'
-        ])
-        
-        # Accounts Receivable (Optional)
-        accounts_receivable = find_row(balance_sheet, [
-            'Net Receivables', 
-            'Accounts Receivable', 
-            'AccountsReceivable',
-            'Total Receivables',
-            'TotalReceivables',
-            'NetReceivables'
-        ])
-        
-        # Calculate metrics
-        # Current Ratio = Current Assets / Current Liabilities
-        metrics['Current Ratio'] = current_assets / current_liabilities
-        
-        # Quick Ratio = (Current Assets - Inventory) / Current Liabilities
-        if inventory is not None:
-            metrics['Quick Ratio'] = (current_assets - inventory) / current_liabilities
-        else:
-            # If inventory not available, use Current Ratio as approximation
-            metrics['Quick Ratio'] = metrics['Current Ratio']
-        
-        # Current Asset Turnover = Revenue / Average Current Assets
-        avg_current_assets = current_assets.copy()
-        for i in range(1, len(current_assets)):
-            avg_current_assets.iloc[i-1] = (current_assets.iloc[i-1] + current_assets.iloc[i]) / 2
-        
-        metrics['Current Asset Turnover'] = revenue / avg_current_assets
-        
-        # Total Asset Turnover = Revenue / Average Total Assets
-        avg_total_assets = total_assets.copy()
-        for i in range(1, len(total_assets)):
-            avg_total_assets.iloc[i-1] = (total_assets.iloc[i-1] + total_assets.iloc[i]) / 2
-        
-        metrics['Total Asset Turnover'] = revenue / avg_total_assets
-        
-        # Days Sales Outstanding = (Accounts Receivable / Revenue) * 365
-        if accounts_receivable is not None:
-            metrics['Days Sales Outstanding'] = (accounts_receivable / (revenue / 365))
+        # yfinance works best with curl_cffi's browser-impersonating session
+        from curl_cffi import requests as curl_requests
+        return curl_requests.Session(impersonate='chrome')
+    except ImportError:
+        import requests
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=32)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+# Client for every call to Yahoo Finance: one shared session, a global rate limit,
+# retries with exponential backoff and full jitter, and a circuit breaker that
+# serves the last good response (stale data) while Yahoo is unhealthy
+class UpstreamClient:
+    def __init__(self, rate=upstream_rate, burst=upstream_burst, retries=upstream_retries,
+                 failure_threshold=upstream_failure_threshold, reset_timeout=upstream_reset_timeout,
+                 backoff_base=0.5, backoff_max=8.0, stale_entries=2000):
+        self.session = None
+        self.session_lock = threading.Lock()
+        self.limiter = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stale = OrderedDict()
+        self.stale_entries = stale_entries
+        self.stale_lock = threading.Lock()
+    
+    def ticker(self, symbol):
+        with self.session_lock:
+            if self.session is None:
+                self.session = create_upstream_session()
+        return yf.Ticker(symbol, session=self.session)
+    
+    def remember(self, key, value):
+        with self.stale_lock:
+            self.stale[key] = value
+            self.stale.move_to_end(key)
+            while len(self.stale) > self.stale_entries:
+                self.stale.popitem(last=False)
+    
+    def cached(self, key):
+        with self.stale_lock:
+            return self.stale.get(key)
+    
+    # Run fn() against Yahoo; key identifies the response for the stale cache
+    # (None disables stale fallback for one-off requests such as price ranges)
+    def call(self, key, fn):
+        if not self.breaker.allow():
+            stale = self.cached(key) if key is not None else None
+            if stale is not None:
+                return stale
+            raise UpstreamUnavailable("Yahoo Finance is temporarily unavailable, please try again shortly")
+        
+        for attempt in range(self.retries + 1):
+            self.limiter.acquire()
+            try:
+                result = fn()
+            except Exception as e:
+                if not is_transient_error(e):
+                    # Not an upstream health problem (e.g. bad symbol), so the breaker is not involved
+                    self.breaker.record_success()
+                    raise
+                if attempt == self.retries:
+                    self.breaker.record_failure()
+                    stale = self.cached(key) if key is not None else None
+                    if stale is not None:
+                        return stale
+                    raise
+                time.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)))
+            else:
+                self.breaker.record_success()
+                if key is not None:
+                    self.remember(key, result)
+                return result
+    
+    # Fetch a yf.Ticker attribute such as 'info' or 'balance_sheet'
+    def get(self, symbol, attribute):
+        value = self.call((symbol, attribute), lambda: getattr(self.ticker(symbol), attribute))
+        # Callers modify statement frames in place, so never hand out the cached object
+        return value.copy() if hasattr(value, 'copy') else value
+
+upstream = UpstreamClient()
+
+# Function to fetch company info and financial statements
+# frequency is either 'annual' or 'quarterly'
+# company_info skips the info request when the caller already has it
+def fetch_financials(ticker, frequency='annual', company_info=None):
+    # Get company info
+    if company_info is None:
+        company_info = upstream.get(ticker, 'info')
+    
+    return (company_info, *fetch_statements(ticker, frequency))
+
+# Function to fetch only the balance sheet, income statement and cash flow (no company info)
+def fetch_statements(ticker, frequency='annual'):
+    if frequency == 'quarterly':
+        balance_sheet = format_statement_columns(upstream.get(ticker, 'quarterly_balance_sheet'))
+        income_stmt = format_statement_columns(upstream.get(ticker, 'quarterly_income_stmt'))
+        cash_flow = format_statement_columns(upstream.get(ticker, 'quarterly_cashflow'))
+    else:
+        balance_sheet = format_statement_columns(upstream.get(ticker, 'balance_sheet'))
+        income_stmt = format_statement_columns(upstream.get(ticker, 'income_stmt'))
+        cash_flow = format_statement_columns(upstream.get(ticker, 'cashflow'))
+    
+    return balance_sheet, income_stmt, cash_flow
+
+# Trailing-twelve-month window over the rows of a quarterly statement.
+# Keeps the last four quarters and their running sum, so each newly reported
+# quarter is a single add/subtract over all line items instead of a recompute.
+class RollingTTM:
+    window = 4
+    
+    def __init__(self, items):
+        self.items = list(items)
+        self.quarters = deque(maxlen=self.window)
+        self.total = np.zeros(len(self.items))
+        self.missing = np.zeros(len(self.items), dtype=np.int64)  # NaN count inside the window
+        self.history = {}  # quarter date -> TTM values
+        self.reported = {}  # quarter date -> reported quarterly values, to spot restatements
+        self.last_date = None
+    
+    # Build the window from a full statement in one vectorized pass
+    @classmethod
+    def from_frame(cls, statement):
+        window = cls(statement.index)
+        ordered = statement[sorted(statement.columns)]
+        values = ordered.to_numpy(dtype=np.float64)
+        
+        # Rolling 4-quarter sums via cumulative sums; any NaN in the window makes the sum NaN
+        filled = np.nan_to_num(values)
+        missing = np.isnan(values).astype(np.int64)
+        zeros = np.zeros((len(window.items), 1))
+        sums = np.cumsum(np.hstack([zeros, filled]), axis=1)
+        counts = np.cumsum(np.hstack([zeros, missing]), axis=1)
+        ttm = sums[:, cls.window:] - sums[:, :-cls.window]
+        ttm[(counts[:, cls.window:] - counts[:, :-cls.window]) > 0] = np.nan
+        
+        for i, date in enumerate(ordered.columns[cls.window - 1:]):
+            window.history[date] = ttm[:, i]
+        for i, date in enumerate(ordered.columns):
+            window.reported[date] = values[:, i]
+        
+        for i in range(max(0, values.shape[1] - cls.window), values.shape[1]):
+            window._append(values[:, i])
+        window.last_date = ordered.columns[-1] if len(ordered.columns) else None
+        return window
+    
+    def _append(self, values):
+        if len(self.quarters) == self.window:
+            oldest = self.quarters[0]
+            self.total -= np.nan_to_num(oldest)
+            self.missing -= np.isnan(oldest)
+        self.quarters.append(values)
+        self.total += np.nan_to_num(values)
+        self.missing += np.isnan(values)
+    
+    # Add a newly reported quarter and record its TTM values
+    def push(self, date, values):
+        self._append(values)
+        self.reported[date] = values
+        self.last_date = date
+        if len(self.quarters) == self.window:
+            self.history[date] = np.where(self.missing > 0, np.nan, self.total)
+    
+    # True when a quarter already in the window was reported with different values
+    def restated(self, statement):
+        for date in statement.columns:
+            if date in self.reported:
+                values = statement[date].to_numpy(dtype=np.float64)
+                if not np.array_equal(values, self.reported[date], equal_nan=True):
+                    return True
+        return False
+    
+    # TTM statement with the most recent quarter first
+    def to_frame(self):
+        dates = sorted(self.history, reverse=True)
+        return pd.DataFrame({date: self.history[date] for date in dates}, index=self.items, columns=dates)
+
+# Rolling TTM windows per ticker (least recently used evicted first), updated as new quarters are reported
+ttm_windows = OrderedDict()
+ttm_windows_size = 1000
+ttm_lock = threading.Lock()
+
+# Function to turn a quarterly income statement into trailing-twelve-month figures
+def trailing_twelve_months(ticker, quarterly_income):
+    with ttm_lock:
+        window = ttm_windows.get(ticker)
+        if window is None or list(quarterly_income.index) != window.items or window.restated(quarterly_income):
+            # New ticker, changed line items or a restated quarter: rebuild from the full statement
+            window = RollingTTM.from_frame(quarterly_income)
+            ttm_windows[ticker] = window
         else:
-            metrics['Days Sales Outstanding'] = np.nan
-        
-        # Profit Margin = Net Income / Revenue
-        metrics['Profit Margin'] = net_income / revenue
-        
-        # Total Liabilities (calculate if not directly available)
-        total_liabilities = find_row(balance_sheet, [
-            'Total Liabilities', 
-            'TotalLiabilities',
-            'Liabilities'
-        ])
-        if total_liabilities is None:
-            # Calculate Total Liabilities by subtracting Total Stockholder Equity from Total Assets
-            total_liabilities = total_assets - shareholder_equity
-        
-        # Debt Ratio = Total Liabilities / Total Assets
-        metrics['Debt Ratio'] = total_liabilities / total_assets
-        
-        # Return on Equity = Net Income / Shareholders' Equity
-        metrics['Return on Equity'] = net_income / shareholder_equity
-        
-        # EBIT for Basic Earning Power
-        ebit = find_row(income_stmt, [
-            'EBIT', 
-            'Operating Income', 
-            'OperatingIncome',
-            'Income Before Tax',
-            'IncomeBeforeTax'
-        ])
-        if ebit is None:
-            # Calculate EBIT as Net Income + Interest Expense + Income Tax Expense
-            ebit = net_income
-            
-            interest_expense = find_row(income_stmt, [
-                'Interest Expense', 
-                'InterestExpense'
-            ])
-            if interest_expense is not None:
-                ebit += interest_expense
-                
-            income_tax = find_row(income_stmt, [
-                'Income Tax Expense', 
-                'IncomeTaxExpense',
-                'Tax Provision',
-                'Provision for Income Taxes',
-                'ProvisionForIncomeTaxes'
-            ])
-            if income_tax is not None:
-                ebit += income_tax
-        
-        # Basic Earning Power = EBIT / Total Assets
-        metrics['Basic Earning Power'] = ebit / total_assets
-        
-        # Fill NaN values with 0 for better display
-        metrics = metrics.fillna(0)
-        
-        # Get industry averages (placeholder - in a real app, this would come from a database)
-        industry_averages = {
-            'Current Ratio': 1.5,
-            'Quick Ratio': 1.0,
-            'Current Asset Turnover': 2.0,
-            'Total Asset Turnover': 0.9,
-            'Days Sales Outstanding': 40.0,
-            'Profit Margin': 0.15,
-            'Debt Ratio': 0.5,
-            'Return on Equity': 0.2,
-            'Basic Earning Power': 0.25
-        }
-        
-        # Transpose the metrics for better display
-        metrics_display = metrics.transpose()
-        
-        # Add industry averages column
-        metrics_display['Industry Average'] = pd.Series(industry_averages)
-        
-        # Create chart data
-        chart_data = {}
-        
-        # Liquidity Ratios Chart - Enhanced with industry comparison and better styling
-        fig1 = go.Figure()
-        
-        # Current Ratio line
-        fig1.add_trace(go.Scatter(
-            x=metrics.index.tolist(), 
-            y=metrics['Current Ratio'].tolist(), 
-            mode='lines+markers', 
-            name='Current Ratio',
-            line=dict(color='#1f77b4', width=3),
-            marker=dict(size=8)
-        ))
-        
-        # Quick Ratio line
-        fig1.add_trace(go.Scatter(
-            x=metrics.index.tolist(), 
-            y=metrics['Quick Ratio'].tolist(), 
-            mode='lines+markers', 
-            name='Quick Ratio',
-            line=dict(color='#ff7f0e', width=3),
-            marker=dict(size=8)
-        ))
-        
-        # Industry average reference lines
-        fig1.add_trace(go.Scatter(
-            x=metrics.index.tolist(),
-            y=[industry_averages['Current Ratio']] * len(metrics.index),
-            mode='lines',
-            line=dict(color='#1f77b4', width=1, dash='dash'),
-            name='Current Ratio Industry Avg'
-        ))
-        
-        fig1.add_trace(go.Scatter(
-            x=metrics.index.tolist(),
-            y=[industry_averages['Quick Ratio']] * len(metrics.index),
-            mode='lines',
-            line=dict(color='#ff7f0e', width=1, dash='dash'),
-            name='Quick Ratio Industry Avg'
-        ))
-        
-        fig1.update_layout(
-            title={
-                'text': 'Liquidity Ratios',
-                'y':0.9,
-                'x':0.5,
-                'xanchor': 'center',
-                'yanchor': 'top',
-                'font': dict(size=22)
-            },
-            xaxis_title='Year',
-            yaxis_title='Ratio Value',
-            legend=dict(
-                orientation="h",
-                yanchor="bottom",
-                y=1.02,
-                xanchor="right",
-                x=1
-            ),
-            template='plotly_white',
-            height=500,
-            margin=dict(l=60, r=40, t=80, b=60)  # Add appropriate margins
-        )
-        chart_data['liquidity'] = json.dumps(fig1, cls=plotly.utils.PlotlyJSONEncoder)
-        
-        # Efficiency Ratios Chart - Enhanced
-        fig2 = go.Figure()
-        
-        # Asset turnover lines
-        fig2.add_trace(go.Scatter(
-            x=metrics.index.tolist(), 
-            y=metrics['Current Asset Turnover'].tolist(), 
-            mode='lines+markers', 
-            name='Current Asset Turnover',
-            line=dict(color='#2ca02c', width=3),
-            marker=dict(size=8)
-        ))
+            for date in sorted(quarterly_income.columns):
+                if date > window.last_date:
+                    window.push(date, quarterly_income[date].to_numpy(dtype=np.float64))
+        ttm_windows.move_to_end(ticker)
+        while len(ttm_windows) > ttm_windows_size:
+            ttm_windows.popitem(last=False)
+        return window.to_frame()
+
+# Function to restrict statements to their common dates, most recent first
+def align_statements(balance_sheet, income_stmt, cash_flow, years_back):
+    # Get common dates across all statements
+    common_dates = sorted(set(balance_sheet.columns).intersection(set(income_stmt.columns)), reverse=True)
+    
+    # Limit to requested years
+    common_dates = common_dates[:min(years_back, len(common_dates))]
+    
+    # Filter to common dates (the cash flow may lack a period whose values were all missing)
+    return balance_sheet[common_dates], income_stmt[common_dates], cash_flow.reindex(columns=common_dates)
+
+# Helper function to average a balance sheet row with the following (older) periods
+# Columns are ordered newest first; the oldest periods average what is available
+def average_balance(row, periods=2):
+    return row.iloc[::-1].rolling(periods, min_periods=1).mean().iloc[::-1]
+
+# Helper function to average a balance sheet item over the full (unaligned) balance sheet
+# history and return it on the aligned dates of row, so the oldest aligned periods still
+# average the earlier balance sheet dates; without a history row itself is averaged
+def average_balance_over(row, item, history=None, periods=2):
+    full = find_row(history, row_aliases[item]) if history is not None else None
+    if full is None:
+        return average_balance(row, periods)
+    return average_balance(full.sort_index(ascending=False), periods).reindex(row.index)
+
+# Function to pick the metric pack for a company and check its required line items
+# Without a sector (e.g. stored history) the first pack whose line items are all present is used
+# Returns (pack name, None), or (None, error) before any ratio is computed
+def resolve_metric_pack(company_info, balance_sheet, income_stmt):
+    def missing_items(name):
+        return [item for item in metric_packs[name]['required']
+                if find_row(balance_sheet, row_aliases[item]) is None and find_row(income_stmt, row_aliases[item]) is None]
+    
+    sector = (company_info or {}).get('sector') or ''
+    industry = (company_info or {}).get('industry') or ''
+    if sector:
+        name = next((name for name, pack in metric_packs.items()
+                     if sector in pack['sectors'] and any(word in industry for word in pack['industries'])), 'General')
+    else:
+        name = next((name for name in metric_packs if not missing_items(name)), 'General')
+    
+    missing = missing_items(name)
+    if missing:
+        return None, (f"Could not find {', '.join(missing)} required by the {name} metric pack. "
+                      f"Available rows: {', '.join(list(balance_sheet.index) + list(income_stmt.index))}")
+    return name, None
+
+# Function to compute a pack's sector ratios; returns a dataframe indexed by period
+def compute_pack_metrics(pack, balance_sheet, income_stmt, average_periods=2, balance_history=None):
+    metrics = pd.DataFrame(index=balance_sheet.columns)
+    for metric, (numerator, denominator, averaged) in pack['metrics'].items():
+        top = find_row(balance_sheet, row_aliases[numerator])
+        if top is None:
+            top = find_row(income_stmt, row_aliases[numerator])
+        bottom = find_row(balance_sheet, row_aliases[denominator])
+        if bottom is None:
+            bottom = find_row(income_stmt, row_aliases[denominator])
+        if top is None or bottom is None:
+            metrics[metric] = np.nan
+            continue
+        if averaged:
+            bottom = average_balance_over(bottom, denominator, balance_history, average_periods)
+        metrics[metric] = top / bottom
+    return metrics
+
+# Statement line items checked by the data-quality diagnostics, with the statement they come from
+diagnostic_items = [
+    ('Current Assets', 'Balance Sheet'),
+    ('Current Liabilities', 'Balance Sheet'),
+    ('Total Assets', 'Balance Sheet'),
+    ('Stockholder Equity', 'Balance Sheet'),
+    ('Inventory', 'Balance Sheet'),
+    ('Accounts Receivable', 'Balance Sheet'),
+    ('Total Liabilities', 'Balance Sheet'),
+    ('Revenue', 'Income Statement'),
+    ('Net Income', 'Income Statement'),
+    ('EBIT', 'Income Statement'),
+    ('Interest Expense', 'Income Statement'),
+    ('Income Tax', 'Income Statement'),
+]
+
+# Helper function to format a statement column for JSON and reports
+def format_period(period):
+    return period.strftime('%Y-%m-%d') if hasattr(period, 'strftime') else str(period)
+
+# Function to record the provenance of a ratio pack: the alias matched for each line item,
+# the fallbacks used when rows are absent, and per period the matched rows with no value
+# and the ratios that were zero-filled. metrics is the ratio frame before fillna(0).
+def diagnose_ratios(balance_sheet, income_stmt, metrics, not_applicable=()):
+    statements = {'Balance Sheet': balance_sheet, 'Income Statement': income_stmt}
+    source = dict(diagnostic_items)
+    aliases = {}
+    for item, statement in diagnostic_items:
+        index = statements[statement].index
+        aliases[item] = next((name for name in row_aliases[item] if name in index), None)
+    
+    # Interest and tax only matter when EBIT has to be rebuilt
+    items = [item for item, _ in diagnostic_items
+             if aliases['EBIT'] is None or item not in ('Interest Expense', 'Income Tax')]
+    absent = [item for item in items if aliases[item] is None]
+    
+    # One missing-value matrix (line items x periods) per statement from the matched rows;
+    # the statements are aligned with the metrics so their columns are the periods
+    found, gaps = [], []
+    for statement, frame in statements.items():
+        rows = [item for item in items if aliases[item] is not None and source[item] == statement]
+        if rows:
+            found += rows
+            gaps.append(np.isnan(frame.loc[[aliases[item] for item in rows]].to_numpy(dtype=np.float64)))
+    missing = np.vstack(gaps) if gaps else np.zeros((0, len(metrics.index)), dtype=bool)
+    imputed = np.isnan(metrics.to_numpy(dtype=np.float64)) & ~metrics.columns.isin(not_applicable)
+    
+    fallbacks = []
+    if aliases['Inventory'] is None and 'Quick Ratio' not in not_applicable:
+        fallbacks.append('Quick Ratio uses the Current Ratio (no Inventory row)')
+    if aliases['Accounts Receivable'] is None and 'Days Sales Outstanding' not in not_applicable:
+        fallbacks.append('Days Sales Outstanding unavailable (no Accounts Receivable row)')
+    if aliases['Total Liabilities'] is None:
+        fallbacks.append('Total Liabilities derived as Total Assets - Stockholder Equity')
+    if aliases['EBIT'] is None:
+        parts = ['Net Income'] + [item for item in ('Interest Expense', 'Income Tax') if aliases[item] is not None]
+        fallbacks.append('EBIT rebuilt as ' + ' + '.join(parts))
+    
+    item_names = np.array(found, dtype=object)
+    metric_columns = np.array(metrics.columns, dtype=object)
+    periods = []
+    for position, period in enumerate(metrics.index):
+        periods.append({
+            'period': format_period(period),
+            'missing_items': item_names[missing[:, position]].tolist(),
+            'imputed_metrics': metric_columns[imputed[position]].tolist(),
+        })
+    
+    return {
+        'aliases': {item: aliases[item] for item in items},
+        'absent_items': absent,
+        'not_applicable': list(not_applicable),
+        'fallbacks': fallbacks,
+        'periods': periods,
+        'missing_count': int(missing.sum()),
+        'imputed_count': int(imputed.sum()),
+    }
+
+# Function to lay out the diagnostics as tables for the exports: one row per period,
+# and one row per line item with the alias it was read from
+def diagnostics_tables(diagnostics):
+    periods = pd.DataFrame([
+        [entry['period'], ', '.join(entry['missing_items']) or 'None', ', '.join(entry['imputed_metrics']) or 'None']
+        for entry in diagnostics.get('periods', [])
+    ], columns=['Period', 'Missing Line Items', 'Zero-Filled Metrics'])
+    sources = pd.DataFrame([
+        [item, alias if alias is not None else 'Not found']
+        for item, alias in diagnostics.get('aliases', {}).items()
+    ] + [['Fallback', fallback] for fallback in diagnostics.get('fallbacks', [])],
+        columns=['Line Item', 'Source Row'])
+    return periods, sources
+
+# Function to compute the ratio pack from statements aligned on the same dates
+# average_periods is the number of balance sheet dates averaged for turnover ratios
+# Pass a dict as diagnostics to have it filled with the data-quality provenance
+# pack is a metric_packs entry; only its required line items are mandatory
+# balance_history is the balance sheet before alignment, used for the turnover averages
+def compute_ratios(balance_sheet, income_stmt, average_periods=2, diagnostics=None, pack=None, balance_history=None):
+    pack = pack or metric_packs['General']
+    
+    # Create a metrics dataframe
+    metrics = pd.DataFrame(index=balance_sheet.columns)
+    
+    # Find key financial rows with alternative names
+    # Current Assets (not reported by every sector, e.g. banks)
+    current_assets = find_row(balance_sheet, row_aliases['Current Assets'])
+    if current_assets is None:
+        if 'Current Assets' in pack['required']:
+            return None, f"Could not find Current Assets in balance sheet. Available rows: {', '.join(balance_sheet.index)}"
+        current_assets = pd.Series(np.nan, index=balance_sheet.columns)
+    
+    # Current Liabilities
+    current_liabilities = find_row(balance_sheet, row_aliases['Current Liabilities'])
+    if current_liabilities is None:
+        if 'Current Liabilities' in pack['required']:
+            return None, f"Could not find Current Liabilities in balance sheet. Available rows: {', '.join(balance_sheet.index)}"
+        current_liabilities = pd.Series(np.nan, index=balance_sheet.columns)
+    
+    # Revenue
+    revenue = find_row(income_stmt, row_aliases['Revenue'])
+    if revenue is None:
+        return None, f"Could not find Revenue in income statement. Available rows: {', '.join(income_stmt.index)}"
+    
+    # Net Income
+    net_income = find_row(income_stmt, row_aliases['Net Income'])
+    if net_income is None:
+        return None, f"Could not find Net Income in income statement. Available rows: {', '.join(income_stmt.index)}"
+    
+    # Total Assets
+    total_assets = find_row(balance_sheet, row_aliases['Total Assets'])
+    if total_assets is None:
+        return None, f"Could not find Total Assets in balance sheet. Available rows: {', '.join(balance_sheet.index)}"
+    
+    # Stockholder Equity
+    shareholder_equity = find_row(balance_sheet, row_aliases['Stockholder Equity'])
+    if shareholder_equity is None:
+        return None, f"Could not find Stockholder Equity in balance sheet. Available rows: {', '.join(balance_sheet.index)}"
+    
+    # Inventory (Optional)
+    inventory = find_row(balance_sheet, row_aliases['Inventory'])
+    
+    # Accounts Receivable (Optional)
+    accounts_receivable = find_row(balance_sheet, row_aliases['Accounts Receivable'])
+    
+    # Calculate metrics
+    # Current Ratio = Current Assets / Current Liabilities
+    metrics['Current Ratio'] = current_assets / current_liabilities
+    
+    # Quick Ratio = (Current Assets - Inventory) / Current Liabilities
+    if inventory is not None:
+        metrics['Quick Ratio'] = (current_assets - inventory) / current_liabilities
+    else:
+        # If inventory not available, use Current Ratio as approximation
+        metrics['Quick Ratio'] = metrics['Current Ratio']
+    
+    # Current Asset Turnover = Revenue / Average Current Assets
+    avg_current_assets = average_balance_over(current_assets, 'Current Assets', balance_history, average_periods)
+    
+    metrics['Current Asset Turnover'] = revenue / avg_current_assets
+    
+    # Total Asset Turnover = Revenue / Average Total Assets
+    avg_total_assets = average_balance_over(total_assets, 'Total Assets', balance_history, average_periods)
+    
+    metrics['Total Asset Turnover'] = revenue / avg_total_assets
+    
+    # Days Sales Outstanding = (Accounts Receivable / Revenue) * 365
+    if accounts_receivable is not None:
+        metrics['Days Sales Outstanding'] = (accounts_receivable / (revenue / 365))
+    else:
+        metrics['Days Sales Outstanding'] = np.nan
+    
+    # Profit Margin = Net Income / Revenue
+    metrics['Profit Margin'] = net_income / revenue
+    
+    # Total Liabilities (calculate if not directly available)
+    total_liabilities = find_row(balance_sheet, row_aliases['Total Liabilities'])
+    if total_liabilities is None:
+        # Calculate Total Liabilities by subtracting Total Stockholder Equity from Total Assets
+        total_liabilities = total_assets - shareholder_equity
+    
+    # Debt Ratio = Total Liabilities / Total Assets
+    metrics['Debt Ratio'] = total_liabilities / total_assets
+    
+    # Return on Equity = Net Income / Shareholders' Equity
+    metrics['Return on Equity'] = net_income / shareholder_equity
+    
+    # EBIT for Basic Earning Power
+    ebit = find_row(income_stmt, row_aliases['EBIT'])
+    if ebit is None:
+        # Calculate EBIT as Net Income + Interest Expense + Income Tax Expense
+        ebit = net_income
+        
+        interest_expense = find_row(income_stmt, row_aliases['Interest Expense'])
+        if interest_expense is not None:
+            ebit += interest_expense
+            
+        income_tax = find_row(income_stmt, row_aliases['Income Tax'])
+        if income_tax is not None:
+            ebit += income_tax
+    
+    # Basic Earning Power = EBIT / Total Assets
+    metrics['Basic Earning Power'] = ebit / total_assets
+    
+    # Record what was missing, matched and imputed before the gaps are filled
+    if diagnostics is not None:
+        diagnostics.update(diagnose_ratios(balance_sheet, income_stmt, metrics, pack['not_applicable']))
+    
+    # Fill NaN values with 0 for better display (ratios the sector does not use stay N/A)
+    metrics = metrics.fillna(0)
+    metrics[pack['not_applicable']] = np.nan
+    
+    return metrics, None
+
+# Price-based market metrics, in display order
+market_metric_names = ['P/E Ratio', 'EV/EBITDA', 'Dividend Yield', 'Volatility (1Y)', 'Max Drawdown (1Y)']
+
+# Trading days used for annualization and the rolling market windows
+trading_days = 252
+
+# Years of daily prices fetched the first time a ticker is seen
+price_history_years = 10
+
+# Record layout of the local daily price store (date is days since the epoch)
+price_dtype = np.dtype([('date', '<i8'), ('close', '<f8'), ('dividend', '<f8'), ('split', '<f8'), ('volume', '<f8')])
+
+# Append-only store of daily prices with one memory-mapped file per ticker.
+# Only the days after the last stored record are ever requested from Yahoo.
+# Yahoo returns closes and dividends already split-adjusted as of the fetch, so
+# when a newly fetched range contains a split the whole history is fetched again
+# and the file rewritten; stored prices are therefore always adjusted as of the
+# last split and are never adjusted again on load.
+class PriceStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+    
+    def path(self, ticker):
+        return os.path.join(self.directory, re.sub(r'[^A-Za-z0-9.\-]', '_', ticker.upper()) + '.bin')
+    
+    def lock(self, ticker):
+        with self.locks_lock:
+            return self.locks.setdefault(ticker.upper(), threading.Lock())
+    
+    # Memory-map the stored records (ignores a partially written trailing record)
+    def read(self, ticker):
+        path = self.path(ticker)
+        count = os.path.getsize(path) // price_dtype.itemsize if os.path.exists(path) else 0
+        if count == 0:
+            return np.empty(0, dtype=price_dtype)
+        return np.memmap(path, dtype=price_dtype, mode='r', shape=(count,))
+    
+    # Append after the last whole record, dropping any partially written trailing bytes
+    def append(self, ticker, records):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path(ticker), 'ab') as f:
+            f.truncate(os.fstat(f.fileno()).st_size // price_dtype.itemsize * price_dtype.itemsize)
+            f.write(records.tobytes())
+    
+    # Replace all stored records (readers keep their mapping of the old file)
+    def rewrite(self, ticker, records):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(ticker)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, 'wb') as f:
+            f.write(records.tobytes())
+        os.replace(temporary, path)
+    
+    # Last day Yahoo was asked about, so weekends and holidays (which return no
+    # rows and never move the last stored date) are only fetched once per day
+    def checked(self, ticker):
+        try:
+            with open(self.path(ticker) + '.checked') as f:
+                return pd.Timestamp(f.read().strip())
+        except (OSError, ValueError):
+            return None
+    
+    def mark_checked(self, ticker, day):
+        with open(self.path(ticker) + '.checked', 'w') as f:
+            f.write(day.strftime('%Y-%m-%d'))
+    
+    # Daily records for [start, end) from Yahoo
+    def fetch(self, ticker, start, end):
+        history = upstream.call(None, lambda: upstream.ticker(ticker).history(
+            start=start.strftime('%Y-%m-%d'), end=end.strftime('%Y-%m-%d'), auto_adjust=False))
+        if history is None or history.empty:
+            return np.empty(0, dtype=price_dtype)
+        
+        index = history.index.tz_localize(None) if history.index.tz is not None else history.index
+        records = np.zeros(len(history), dtype=price_dtype)
+        records['date'] = index.normalize().values.astype('datetime64[D]').astype(np.int64)
+        records['close'] = history['Close'].to_numpy(dtype=np.float64)
+        records['dividend'] = history.get('Dividends', pd.Series(0.0, index=history.index)).to_numpy(dtype=np.float64)
+        records['split'] = history.get('Stock Splits', pd.Series(0.0, index=history.index)).to_numpy(dtype=np.float64)
+        records['volume'] = history.get('Volume', pd.Series(np.nan, index=history.index)).to_numpy(dtype=np.float64)
+        return records
+    
+    # Fetch and append the missing date range up to (but excluding) today. The lock file
+    # keeps worker processes from appending the same range twice.
+    def update(self, ticker):
+        os.makedirs(self.directory, exist_ok=True)
+        with self.lock(ticker), open(self.path(ticker) + '.lock', 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            today = pd.Timestamp.today().normalize()
+            checked = self.checked(ticker)
+            if checked is not None and checked >= today:
+                return
+            
+            stored = self.read(ticker)
+            if len(stored):
+                first = pd.Timestamp(int(stored['date'][0]), unit='D')
+                start = pd.Timestamp(int(stored['date'][-1]), unit='D') + pd.Timedelta(days=1)
+            else:
+                start = today - pd.DateOffset(years=price_history_years)
+            
+            if start < today:
+                records = self.fetch(ticker, start, today)
+                # Never append days that are already stored
+                if len(stored):
+                    records = records[records['date'] > stored['date'][-1]]
+                if len(stored) and (records['split'] > 0).any():
+                    # A new split: the stored prices are on the old share basis, so refetch them
+                    refetched = self.fetch(ticker, first, today)
+                    if not len(refetched):
+                        return
+                    self.rewrite(ticker, refetched)
+                elif len(records):
+                    self.append(ticker, records)
+            self.mark_checked(ticker, today)
+    
+    # Daily closes and dividends (split-adjusted as of the last split) indexed by date
+    def load(self, ticker):
+        self.update(ticker)
+        stored = self.read(ticker)
+        return pd.DataFrame({
+            'close': stored['close'],
+            'dividend': stored['dividend'],
+        }, index=pd.to_datetime(stored['date'].astype('datetime64[D]')))
+
+price_store = PriceStore(os.path.join(DATA_DIR, 'prices'))
+
+# Annualized volatility of daily log returns over a trailing window (NaN until the window fills)
+def rolling_volatility(close, window=trading_days):
+    result = np.full(len(close), np.nan)
+    returns = np.diff(np.log(close))
+    if len(returns) >= window:
+        result[window:] = sliding_window_view(returns, window).std(axis=1, ddof=1) * np.sqrt(trading_days)
+    return result
+
+# Largest peak-to-trough decline inside a trailing window (a negative fraction)
+def rolling_max_drawdown(close, window=trading_days):
+    result = np.full(len(close), np.nan)
+    if len(close) >= window:
+        windows = sliding_window_view(close, window)
+        result[window - 1:] = (windows / np.maximum.accumulate(windows, axis=1) - 1).min(axis=1)
+    return result
+
+# Function to compute price-based market metrics at each statement date
+# Returns the metrics dataframe and the daily price history used for the charts
+def compute_market_metrics(ticker, dates, balance_sheet, income_stmt, company_info):
+    prices = price_store.load(ticker)
+    market_metrics = pd.DataFrame(index=dates, columns=market_metric_names, dtype=np.float64)
+    if prices.empty:
+        return market_metrics, None
+    
+    close = prices['close'].to_numpy()
+    history = pd.DataFrame({
+        'close': close,
+        'drawdown': close / np.maximum.accumulate(close) - 1,
+        'volatility': rolling_volatility(close),
+        'max_drawdown': rolling_max_drawdown(close)
+    }, index=prices.index)
+    
+    # Last trading day on or before each statement date
+    day_numbers = prices.index.values.astype('datetime64[D]').astype(np.int64)
+    date_numbers = pd.to_datetime(pd.Index(dates)).values.astype('datetime64[D]').astype(np.int64)
+    positions = np.searchsorted(day_numbers, date_numbers, side='right') - 1
+    in_range = positions >= 0
+    positions = np.clip(positions, 0, None)
+    
+    def at_dates(values):
+        return pd.Series(np.where(in_range, values[positions], np.nan), index=dates)
+    
+    price = at_dates(close)
+    
+    # Shares from the balance sheet, falling back to the current share count
+    shares = find_row(balance_sheet, row_aliases['Shares Outstanding'])
+    if shares is None:
+        shares = pd.Series(company_info.get('sharesOutstanding', np.nan) if company_info else np.nan, index=dates)
+    shares = shares.replace(0, np.nan)
+    market_cap = price * shares
+    
+    # P/E Ratio = Price / (Net Income / Shares)
+    net_income = find_row(income_stmt, row_aliases['Net Income'])
+    if net_income is not None:
+        market_metrics['P/E Ratio'] = price / (net_income / shares)
+    
+    # EV/EBITDA = (Market Cap + Total Debt - Cash) / EBITDA
+    ebitda = find_row(income_stmt, row_aliases['EBITDA'])
+    if ebitda is None:
+        ebit = find_row(income_stmt, row_aliases['EBIT'])
+        depreciation = find_row(income_stmt, row_aliases['Depreciation And Amortization'])
+        if ebit is not None and depreciation is not None:
+            ebitda = ebit + depreciation
+    if ebitda is not None:
+        total_debt = find_row(balance_sheet, row_aliases['Total Debt'])
+        cash = find_row(balance_sheet, row_aliases['Cash'])
+        enterprise_value = (market_cap
+                            + (total_debt.fillna(0) if total_debt is not None else 0)
+                            - (cash.fillna(0) if cash is not None else 0))
+        market_metrics['EV/EBITDA'] = enterprise_value / ebitda.replace(0, np.nan)
+    
+    # Dividend Yield = Dividends paid over the trailing year / Price
+    cumulative_dividends = np.concatenate([[0.0], np.cumsum(prices['dividend'].to_numpy())])
+    year_ago = np.searchsorted(day_numbers, date_numbers - 365, side='right')
+    trailing_dividends = cumulative_dividends[positions + 1] - cumulative_dividends[year_ago]
+    market_metrics['Dividend Yield'] = pd.Series(np.where(in_range, trailing_dividends, np.nan), index=dates) / price
+    
+    market_metrics['Volatility (1Y)'] = at_dates(history['volatility'].to_numpy())
+    market_metrics['Max Drawdown (1Y)'] = at_dates(history['max_drawdown'].to_numpy())
+    
+    return market_metrics, history
+
+# Radar score categories, in chart order
+radar_categories = ['Liquidity', 'Efficiency', 'Profitability', 'Solvency']
+
+# How each ratio enters the radar scores (1.0 = industry average):
+#   'ratio'      value / benchmark (higher is better)
+#   'inverse'    benchmark / max(value, floor), 1.0 for a zero or negative value (lower is better, e.g. DSO)
+#   'complement' 2 - value / benchmark (lower is better, e.g. Debt Ratio)
+# cap limits a normalized score; min_benchmark keeps small benchmarks from inflating scores.
+# RADAR_CAPS overrides the caps, e.g. '{"Current Ratio": 3, "Return on Equity": 2.5}'.
+radar_components = {
+    'Current Ratio': {'category': 'Liquidity', 'transform': 'ratio', 'cap': 2.0},
+    'Quick Ratio': {'category': 'Liquidity', 'transform': 'ratio', 'cap': 2.0},
+    'Current Asset Turnover': {'category': 'Efficiency', 'transform': 'ratio', 'cap': None},
+    'Total Asset Turnover': {'category': 'Efficiency', 'transform': 'ratio', 'cap': None},
+    'Days Sales Outstanding': {'category': 'Efficiency', 'transform': 'inverse', 'cap': None, 'floor': 1.0},
+    'Profit Margin': {'category': 'Profitability', 'transform': 'ratio', 'cap': None, 'min_benchmark': 0.01},
+    'Return on Equity': {'category': 'Profitability', 'transform': 'ratio', 'cap': None, 'min_benchmark': 0.01},
+    'Basic Earning Power': {'category': 'Profitability', 'transform': 'ratio', 'cap': None, 'min_benchmark': 0.01},
+    'Debt Ratio': {'category': 'Solvency', 'transform': 'complement', 'cap': None}
+}
+if os.environ.get('RADAR_CAPS'):
+    for metric, cap in json.loads(os.environ['RADAR_CAPS']).items():
+        radar_components[metric]['cap'] = cap
+
+# Function to turn the radar configuration into arrays over the metric_names schema
+@lru_cache(maxsize=1)
+def radar_arrays():
+    components = [radar_components.get(name) for name in metric_names]
+    benchmarks = np.array([max(industry_averages[name], (c or {}).get('min_benchmark', 0)) for name, c in zip(metric_names, components)])
+    transforms = np.array([(c or {}).get('transform', '') for c in components])
+    caps = np.array([np.inf if not c or c.get('cap') is None else c['cap'] for c in components], dtype=np.float64)
+    floors = np.array([(c or {}).get('floor', 0.0) for c in components])
+    
+    # membership[m, k] is 1 when metric m belongs to category k
+    membership = np.zeros((len(metric_names), len(radar_categories)))
+    for m, c in enumerate(components):
+        if c:
+            membership[m, radar_categories.index(c['category'])] = 1
+    return benchmarks, transforms, caps, floors, membership
+
+# Function to compute the radar category scores for any number of rows at once.
+# values has the metric_names schema on its last axis ([metrics], [periods, metrics],
+# [tickers, periods, metrics], ...); the result has radar_categories on the last axis.
+# Each category averages its normalized ratios, skipping ratios that are not reported.
+def radar_score_matrix(values):
+    values = np.asarray(values, dtype=np.float64)
+    benchmarks, transforms, caps, floors, membership = radar_arrays()
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = values / benchmarks
+        normalized = np.where(transforms == 'complement', 2 - ratio, ratio)
+        inverse = np.where(values > 0, benchmarks / np.maximum(values, floors), np.where(np.isnan(values), np.nan, 1.0))
+        normalized = np.where(transforms == 'inverse', inverse, normalized)
+        normalized = np.minimum(normalized, caps)
+        
+        reported = ~np.isnan(normalized)
+        totals = np.where(reported, normalized, 0.0) @ membership
+        counts = reported @ membership
+        return np.where(counts > 0, totals / counts, np.nan)
+
+# Function to compute the radar chart category scores (1.0 = industry average)
+# from the most recent metric values
+def radar_scores(recent):
+    return radar_score_matrix([recent[name] for name in metric_names]).tolist()
+
+# Generator yielding (name, Plotly JSON) for each chart as soon as it is serialized
+def iter_charts(ticker, metrics, period_label='Year', market_history=None):
+    # Liquidity Ratios Chart - Enhanced with industry comparison and better styling
+    fig1 = go.Figure()
+    
+    # Current Ratio line
+    fig1.add_trace(go.Scatter(
+        x=metrics.index.tolist(), 
+        y=metrics['Current Ratio'].tolist(), 
+        mode='lines+markers', 
+        name='Current Ratio',
+        line=dict(color='#1f77b4', width=3),
+        marker=dict(size=8)
+    ))
+    
+    # Quick Ratio line
+    fig1.add_trace(go.Scatter(
+        x=metrics.index.tolist(), 
+        y=metrics['Quick Ratio'].tolist(), 
+        mode='lines+markers', 
+        name='Quick Ratio',
+        line=dict(color='#ff7f0e', width=3),
+        marker=dict(size=8)
+    ))
+    
+    # Industry average reference lines
+    fig1.add_trace(go.Scatter(
+        x=metrics.index.tolist(),
+        y=[industry_averages['Current Ratio']] * len(metrics.index),
+        mode='lines',
+        line=dict(color='#1f77b4', width=1, dash='dash'),
+        name='Current Ratio Industry Avg'
+    ))
+    
+    fig1.add_trace(go.Scatter(
+        x=metrics.index.tolist(),
+        y=[industry_averages['Quick Ratio']] * len(metrics.index),
+        mode='lines',
+        line=dict(color='#ff7f0e', width=1, dash='dash'),
+        name='Quick Ratio Industry Avg'
+    ))
+    
+    fig1.update_layout(
+        title={
+            'text': 'Liquidity Ratios',
+            'y':0.9,
+            'x':0.5,
+            'xanchor': 'center',
+            'yanchor': 'top',
+            'font': dict(size=22)
+        },
+        xaxis_title=period_label,
+        yaxis_title='Ratio Value',
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1
+        ),
+        template='plotly_white',
+        height=500,
+        margin=dict(l=60, r=40, t=80, b=60)  # Add appropriate margins
+    )
+    yield 'liquidity', json.dumps(fig1, cls=plotly.utils.PlotlyJSONEncoder)
+    
+    # Efficiency Ratios Chart - Enhanced
+    fig2 = go.Figure()
+    
+    # Asset turnover lines
+    fig2.add_trace(go.Scatter(
+        x=metrics.index.tolist(), 
+        y=metrics['Current Asset Turnover'].tolist(), 
+        mode='lines+markers', 
+        name='Current Asset Turnover',
+        line=dict(color='#2ca02c', width=3),
+        marker=dict(size=8)
+    ))
+    
+    fig2.add_trace(go.Scatter(
+        x=metrics.index.tolist(), 
+        y=metrics['Total Asset Turnover'].tolist(), 
+        mode='lines+markers', 
+        name='Total Asset Turnover',
+        line=dict(color='#d62728', width=3),
+        marker=dict(size=8)
+    ))
+    
+    # Industry average reference lines
+    fig2.add_trace(go.Scatter(
+        x=metrics.index.tolist(),
+        y=[industry_averages['Current Asset Turnover']] * len(metrics.index),
+        mode='lines',
+        line=dict(color='#2ca02c', width=1, dash='dash'),
+        name='Current Asset Turnover Ind. Avg'
+    ))
+    
+    fig2.add_trace(go.Scatter(
+        x=metrics.index.tolist(),
+        y=[industry_averages['Total Asset Turnover']] * len(metrics.index),
+        mode='lines',
+        line=dict(color='#d62728', width=1, dash='dash'),
+        name='Total Asset Turnover Ind. Avg'
+    ))
+    
+    fig2.update_layout(
+        title={
+            'text': 'Asset Turnover Ratios',
+            'y':0.9,
+            'x':0.5,
+            'xanchor': 'center',
+            'yanchor': 'top',
+            'font': dict(size=22)
+        },
+        xaxis_title=period_label,
+        yaxis_title='Turnover Ratio',
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1
+        ),
+        template='plotly_white',
+        height=500,
+        margin=dict(l=60, r=40, t=80, b=60)  # Add appropriate margins
+    )
+    yield 'efficiency', json.dumps(fig2, cls=plotly.utils.PlotlyJSONEncoder)
+    
+    # Profitability Ratios Chart - Enhanced
+    fig3 = go.Figure()
+    
+    # Profitability metrics
+    fig3.add_trace(go.Bar(
+        x=metrics.index.tolist(), 
+        y=metrics['Profit Margin'].tolist(), 
+        name='Profit Margin',
+        marker_color='#9467bd'
+    ))
+    
+    fig3.add_trace(go.Bar(
+        x=metrics.index.tolist(), 
+        y=metrics['Return on Equity'].tolist(), 
+        name='Return on Equity',
+        marker_color='#8c564b'
+    ))
+    
+    fig3.add_trace(go.Bar(
+        x=metrics.index.tolist(), 
+        y=metrics['Basic Earning Power'].tolist(), 
+        name='Basic Earning Power',
+        marker_color='#e377c2'
+    ))
+    
+    # Industry average lines
+    fig3.add_trace(go.Scatter(
+        x=metrics.index.tolist(),
+        y=[industry_averages['Profit Margin']] * len(metrics.index),
+        mode='lines',
+        line=dict(color='#9467bd', width=2, dash='dash'),
+        name='Profit Margin Ind. Avg'
+    ))
+    
+    fig3.add_trace(go.Scatter(
+        x=metrics.index.tolist(),
+        y=[industry_averages['Return on Equity']] * len(metrics.index),
+        mode='lines',
+        line=dict(color='#8c564b', width=2, dash='dash'),
+        name='ROE Ind. Avg'
+    ))
+    
+    fig3.add_trace(go.Scatter(
+        x=metrics.index.tolist(),
+        y=[industry_averages['Basic Earning Power']] * len(metrics.index),
+        mode='lines',
+        line=dict(color='#e377c2', width=2, dash='dash'),
+        name='BEP Ind. Avg'
+    ))
+    
+    fig3.update_layout(
+        title={
+            'text': 'Profitability Ratios',
+            'y':0.9,
+            'x':0.5,
+            'xanchor': 'center',
+            'yanchor': 'top',
+            'font': dict(size=22)
+        },
+        xaxis_title=period_label,
+        yaxis_title='Ratio Value',
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1
+        ),
+        template='plotly_white',
+        height=500,
+        margin=dict(l=60, r=40, t=80, b=60),  # Add appropriate margins
+        barmode='group'
+    )
+    yield 'profitability', json.dumps(fig3, cls=plotly.utils.PlotlyJSONEncoder)
+    
+    # Debt Ratio Chart - Enhanced with comparison
+    fig4 = go.Figure()
+    
+    # Debt ratio bars
+    fig4.add_trace(go.Bar(
+        x=metrics.index.tolist(), 
+        y=metrics['Debt Ratio'].tolist(), 
+        name='Debt Ratio',
+        marker_color='#7f7f7f'
+    ))
+    
+    # Industry average line
+    fig4.add_trace(go.Scatter(
+        x=metrics.index.tolist(),
+        y=[industry_averages['Debt Ratio']] * len(metrics.index),
+        mode='lines',
+        line=dict(color='red', width=2, dash='dash'),
+        name='Industry Average'
+    ))
+    
+    fig4.update_layout(
+        title={
+            'text': 'Debt Ratio',
+            'y':0.9,
+            'x':0.5,
+            'xanchor': 'center',
+            'yanchor': 'top',
+            'font': dict(size=22)
+        },
+        xaxis_title=period_label,
+        yaxis_title='Ratio Value',
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1
+        ),
+        template='plotly_white',
+        height=500,
+        margin=dict(l=60, r=40, t=80, b=60)  # Add appropriate margins
+    )
+    yield 'solvency', json.dumps(fig4, cls=plotly.utils.PlotlyJSONEncoder)
+    
+    # Days Sales Outstanding Chart (if data available)
+    if not metrics['Days Sales Outstanding'].isnull().all() and not (metrics['Days Sales Outstanding'] == 0).all():
+        fig5 = go.Figure()
         
-        fig2.add_trace(go.Scatter(
+        # DSO line
+        fig5.add_trace(go.Scatter(
             x=metrics.index.tolist(), 
-            y=metrics['Total Asset Turnover'].tolist(), 
+            y=metrics['Days Sales Outstanding'].tolist(), 
             mode='lines+markers', 
-            name='Total Asset Turnover',
-            line=dict(color='#d62728', width=3),
+            name='Days Sales Outstanding',
+            line=dict(color='#17becf', width=3),
             marker=dict(size=8)
         ))
         
-        # Industry average reference lines
-        fig2.add_trace(go.Scatter(
-            x=metrics.index.tolist(),
-            y=[industry_averages['Current Asset Turnover']] * len(metrics.index),
-            mode='lines',
-            line=dict(color='#2ca02c', width=1, dash='dash'),
-            name='Current Asset Turnover Ind. Avg'
-        ))
-        
-        fig2.add_trace(go.Scatter(
+        # Industry average
+        fig5.add_trace(go.Scatter(
             x=metrics.index.tolist(),
-            y=[industry_averages['Total Asset Turnover']] * len(metrics.index),
+            y=[industry_averages['Days Sales Outstanding']] * len(metrics.index),
             mode='lines',
-            line=dict(color='#d62728', width=1, dash='dash'),
-            name='Total Asset Turnover Ind. Avg'
+            line=dict(color='#17becf', width=1, dash='dash'),
+            name='Industry Average'
         ))
         
-        fig2.update_layout(
+        fig5.update_layout(
             title={
-                'text': 'Asset Turnover Ratios',
+                'text': 'Days Sales Outstanding',
                 'y':0.9,
                 'x':0.5,
                 'xanchor': 'center',
                 'yanchor': 'top',
                 'font': dict(size=22)
             },
-            xaxis_title='Year',
-            yaxis_title='Turnover Ratio',
+            xaxis_title=period_label,
+            yaxis_title='Days',
             legend=dict(
                 orientation="h",
                 yanchor="bottom",
@@ -439,69 +1501,45 @@ def calculate_metrics(ticker, years_back=5):
             height=500,
             margin=dict(l=60, r=40, t=80, b=60)  # Add appropriate margins
         )
-        chart_data['efficiency'] = json.dumps(fig2, cls=plotly.utils.PlotlyJSONEncoder)
-        
-        # Profitability Ratios Chart - Enhanced
-        fig3 = go.Figure()
-        
-        # Profitability metrics
-        fig3.add_trace(go.Bar(
-            x=metrics.index.tolist(), 
-            y=metrics['Profit Margin'].tolist(), 
-            name='Profit Margin',
-            marker_color='#9467bd'
-        ))
-        
-        fig3.add_trace(go.Bar(
-            x=metrics.index.tolist(), 
-            y=metrics['Return on Equity'].tolist(), 
-            name='Return on Equity',
-            marker_color='#8c564b'
-        ))
-        
-        fig3.add_trace(go.Bar(
-            x=metrics.index.tolist(), 
-            y=metrics['Basic Earning Power'].tolist(), 
-            name='Basic Earning Power',
-            marker_color='#e377c2'
-        ))
-        
-        # Industry average lines
-        fig3.add_trace(go.Scatter(
-            x=metrics.index.tolist(),
-            y=[industry_averages['Profit Margin']] * len(metrics.index),
-            mode='lines',
-            line=dict(color='#9467bd', width=2, dash='dash'),
-            name='Profit Margin Ind. Avg'
-        ))
-        
-        fig3.add_trace(go.Scatter(
-            x=metrics.index.tolist(),
-            y=[industry_averages['Return on Equity']] * len(metrics.index),
+        yield 'dso', json.dumps(fig5, cls=plotly.utils.PlotlyJSONEncoder)
+    
+    # Market Charts (if price history available)
+    if market_history is not None and not market_history.empty:
+        fig7 = go.Figure()
+        
+        # Price line
+        fig7.add_trace(go.Scatter(
+            x=market_history.index.strftime('%Y-%m-%d').tolist(),
+            y=market_history['close'].tolist(),
             mode='lines',
-            line=dict(color='#8c564b', width=2, dash='dash'),
-            name='ROE Ind. Avg'
+            name='Close Price',
+            line=dict(color='#1f77b4', width=2)
         ))
         
-        fig3.add_trace(go.Scatter(
-            x=metrics.index.tolist(),
-            y=[industry_averages['Basic Earning Power']] * len(metrics.index),
+        # Drawdown from the running peak on a secondary axis
+        fig7.add_trace(go.Scatter(
+            x=market_history.index.strftime('%Y-%m-%d').tolist(),
+            y=market_history['drawdown'].tolist(),
             mode='lines',
-            line=dict(color='#e377c2', width=2, dash='dash'),
-            name='BEP Ind. Avg'
+            name='Drawdown',
+            line=dict(color='#d62728', width=1),
+            fill='tozeroy',
+            fillcolor='rgba(214, 39, 40, 0.15)',
+            yaxis='y2'
         ))
         
-        fig3.update_layout(
+        fig7.update_layout(
             title={
-                'text': 'Profitability Ratios',
+                'text': 'Price and Drawdown',
                 'y':0.9,
                 'x':0.5,
                 'xanchor': 'center',
                 'yanchor': 'top',
                 'font': dict(size=22)
             },
-            xaxis_title='Year',
-            yaxis_title='Ratio Value',
+            xaxis_title='Date',
+            yaxis=dict(title='Price'),
+            yaxis2=dict(title='Drawdown', overlaying='y', side='right', tickformat='.0%'),
             legend=dict(
                 orientation="h",
                 yanchor="bottom",
@@ -511,199 +1549,1562 @@ def calculate_metrics(ticker, years_back=5):
             ),
             template='plotly_white',
             height=500,
-            margin=dict(l=60, r=40, t=80, b=60),  # Add appropriate margins
-            barmode='group'
+            margin=dict(l=60, r=60, t=80, b=60)  # Add appropriate margins
         )
-        chart_data['profitability'] = json.dumps(fig3, cls=plotly.utils.PlotlyJSONEncoder)
+        yield 'market', json.dumps(fig7, cls=plotly.utils.PlotlyJSONEncoder)
         
-        # Debt Ratio Chart - Enhanced with comparison
-        fig4 = go.Figure()
-        
-        # Debt ratio bars
-        fig4.add_trace(go.Bar(
-            x=metrics.index.tolist(), 
-            y=metrics['Debt Ratio'].tolist(), 
-            name='Debt Ratio',
-            marker_color='#7f7f7f'
-        ))
+        fig8 = go.Figure()
         
-        # Industry average line
-        fig4.add_trace(go.Scatter(
-            x=metrics.index.tolist(),
-            y=[industry_averages['Debt Ratio']] * len(metrics.index),
+        # Rolling volatility line
+        fig8.add_trace(go.Scatter(
+            x=market_history.index.strftime('%Y-%m-%d').tolist(),
+            y=market_history['volatility'].tolist(),
             mode='lines',
-            line=dict(color='red', width=2, dash='dash'),
-            name='Industry Average'
+            name='Volatility (1Y)',
+            line=dict(color='#9467bd', width=2)
         ))
         
-        fig4.update_layout(
+        fig8.update_layout(
             title={
-                'text': 'Debt Ratio',
+                'text': 'Rolling 1-Year Volatility',
                 'y':0.9,
                 'x':0.5,
                 'xanchor': 'center',
                 'yanchor': 'top',
                 'font': dict(size=22)
             },
-            xaxis_title='Year',
-            yaxis_title='Ratio Value',
-            legend=dict(
-                orientation="h",
-                yanchor="bottom",
-                y=1.02,
-                xanchor="right",
-                x=1
-            ),
+            xaxis_title='Date',
+            yaxis=dict(title='Annualized Volatility', tickformat='.0%'),
             template='plotly_white',
             height=500,
             margin=dict(l=60, r=40, t=80, b=60)  # Add appropriate margins
         )
-        chart_data['solvency'] = json.dumps(fig4, cls=plotly.utils.PlotlyJSONEncoder)
-        
-        # Days Sales Outstanding Chart (if data available)
-        if not metrics['Days Sales Outstanding'].isnull().all() and not (metrics['Days Sales Outstanding'] == 0).all():
-            fig5 = go.Figure()
-            
-            # DSO line
-            fig5.add_trace(go.Scatter(
-                x=metrics.index.tolist(), 
-                y=metrics['Days Sales Outstanding'].tolist(), 
-                mode='lines+markers', 
-                name='Days Sales Outstanding',
-                line=dict(color='#17becf', width=3),
-                marker=dict(size=8)
-            ))
+        yield 'volatility', json.dumps(fig8, cls=plotly.utils.PlotlyJSONEncoder)
+    
+    # Radar Chart for Comparative Overview
+    categories = radar_categories
+    
+    # Use the most recent values
+    liquidity_avg, efficiency_avg, profitability_avg, solvency_avg = radar_scores(metrics.iloc[0])
+    
+    # Create radar chart
+    fig6 = go.Figure()
+    
+    fig6.add_trace(go.Scatterpolar(
+        r=[liquidity_avg, efficiency_avg, profitability_avg, solvency_avg],
+        theta=categories,
+        fill='toself',
+        name=ticker,
+        line=dict(color='#1f77b4', width=3),
+        fillcolor='rgba(31, 119, 180, 0.3)'
+    ))
+    
+    fig6.add_trace(go.Scatterpolar(
+        r=[1, 1, 1, 1],  # Industry baseline
+        theta=categories,
+        fill='toself',
+        name='Industry Average',
+        line=dict(color='#ff7f0e', width=2, dash='dash'),
+        fillcolor='rgba(255, 127, 14, 0.1)'
+    ))
+    
+    fig6.update_layout(
+        polar=dict(
+            radialaxis=dict(
+                visible=True,
+                range=[0, 2]
+            )
+        ),
+        title={
+            'text': 'Financial Performance Overview',
+            'y':0.95,
+            'x':0.5,
+            'xanchor': 'center',
+            'yanchor': 'top',
+            'font': dict(size=22)
+        },
+        showlegend=True,
+        template='plotly_white',
+        height=650,  # Increased from 600
+        margin=dict(l=80, r=80, t=100, b=80)  # Add more margin space
+    )
+    yield 'radar', json.dumps(fig6, cls=plotly.utils.PlotlyJSONEncoder)
+
+# Function to build the Plotly charts for a metrics dataframe
+def build_charts(ticker, metrics, period_label='Year', market_history=None):
+    return dict(iter_charts(ticker, metrics, period_label, market_history))
+
+# Local store of every annual statement snapshot fetched from Yahoo, merged into
+# one deduplicated history per ticker. Values are keyed by (ticker, fiscal_date, ...)
+# so range queries stay index lookups as the history grows; a later fetch of the
+# same fiscal period (e.g. a restatement) replaces the earlier value.
+class SnapshotStore:
+    statements = ('balance_sheet', 'income_stmt', 'cash_flow')
+    
+    def __init__(self, path):
+        self.path = path
+        self.initialized = False
+        self.init_lock = threading.Lock()
+    
+    def connect(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        if not self.initialized:
+            with self.init_lock:
+                connection.execute('PRAGMA journal_mode=WAL')
+                connection.execute('''
+                    CREATE TABLE IF NOT EXISTS statement_values (
+                        ticker TEXT NOT NULL,
+                        fiscal_date TEXT NOT NULL,
+                        statement TEXT NOT NULL,
+                        line_item TEXT NOT NULL,
+                        position INTEGER NOT NULL,
+                        value REAL NOT NULL,
+                        fetched_at TEXT NOT NULL,
+                        PRIMARY KEY (ticker, fiscal_date, statement, line_item)
+                    ) WITHOUT ROWID
+                ''')
+                connection.commit()
+                self.initialized = True
+        return connection
+    
+    # Merge a freshly fetched set of statements into the stored history
+    def record(self, ticker, balance_sheet, income_stmt, cash_flow):
+        fetched_at = datetime.now().isoformat(timespec='seconds')
+        rows = []
+        for statement, df in zip(self.statements, (balance_sheet, income_stmt, cash_flow)):
+            values = df.to_numpy(dtype=np.float64)
+            for position, line_item in enumerate(df.index):
+                for column, fiscal_date in enumerate(df.columns):
+                    if not np.isnan(values[position, column]):
+                        rows.append((ticker, str(fiscal_date), statement, str(line_item), position,
+                                     float(values[position, column]), fetched_at))
+        
+        connection = self.connect()
+        try:
+            with connection:
+                connection.executemany('''
+                    INSERT INTO statement_values VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (ticker, fiscal_date, statement, line_item) DO UPDATE SET
+                        position = excluded.position, value = excluded.value, fetched_at = excluded.fetched_at
+                ''', rows)
+        finally:
+            connection.close()
+    
+    # Fiscal dates stored for a ticker, most recent first
+    def periods(self, ticker):
+        connection = self.connect()
+        try:
+            rows = connection.execute(
+                'SELECT DISTINCT fiscal_date FROM statement_values WHERE ticker = ? ORDER BY fiscal_date DESC',
+                (ticker,)).fetchall()
+        finally:
+            connection.close()
+        return [row[0] for row in rows]
+    
+    # Stored statements for a ticker within an optional fiscal date range (inclusive)
+    def history(self, ticker, start=None, end=None):
+        query = 'SELECT fiscal_date, statement, line_item, position, value FROM statement_values WHERE ticker = ?'
+        params = [ticker]
+        if start:
+            query += ' AND fiscal_date >= ?'
+            params.append(start)
+        if end:
+            query += ' AND fiscal_date <= ?'
+            params.append(end)
+        
+        connection = self.connect()
+        try:
+            rows = pd.read_sql_query(query, connection, params=params)
+        finally:
+            connection.close()
+        
+        frames = []
+        for statement in self.statements:
+            subset = rows[rows['statement'] == statement]
+            frame = subset.pivot(index='line_item', columns='fiscal_date', values='value')
             
-            # Industry average
-            fig5.add_trace(go.Scatter(
-                x=metrics.index.tolist(),
-                y=[industry_averages['Days Sales Outstanding']] * len(metrics.index),
-                mode='lines',
-                line=dict(color='#17becf', width=1, dash='dash'),
-                name='Industry Average'
-            ))
+            # Keep Yahoo's line item order and put the most recent period first
+            order = subset.groupby('line_item')['position'].min().sort_values(kind='stable')
+            frame = frame.reindex(index=order.index, columns=sorted(frame.columns, reverse=True))
+            frame.index.name = None
+            frame.columns.name = None
+            frames.append(frame)
+        return tuple(frames)
+
+snapshot_store = SnapshotStore(os.path.join(DATA_DIR, 'snapshots.db'))
+
+# Function to fetch annual statements and merge them with every stored snapshot,
+# so analyses can reach further back than the few years Yahoo returns
+def fetch_annual_history(ticker, company_info=None):
+    company_info, balance_sheet, income_stmt, cash_flow = fetch_financials(ticker, company_info=company_info)
+    try:
+        snapshot_store.record(ticker, balance_sheet, income_stmt, cash_flow)
+        balance_sheet, income_stmt, cash_flow = snapshot_store.history(ticker)
+    except sqlite3.Error as store_error:
+        # Fall back to the statements just fetched
+        print(f"Snapshot store error for {ticker}: {store_error}")
+    return company_info, balance_sheet, income_stmt, cash_flow
+
+# Compact record of the ratio pack for one ticker: a float64 array of shape
+# [periods, metrics] using the shared metric_names schema, with periods stored
+# as datetime64[D]. Used for caching and cross-ticker aggregation; DataFrames
+# are only built from it at the presentation edge.
+class MetricsRecord:
+    __slots__ = ('ticker', 'periods', 'values')
+    
+    schema = tuple(metric_names)
+    
+    def __init__(self, ticker, periods, values):
+        self.ticker = ticker
+        self.periods = np.asarray(periods, dtype='datetime64[D]')
+        self.values = np.ascontiguousarray(values, dtype=np.float64).reshape(len(self.periods), len(self.schema))
+    
+    @classmethod
+    def from_frame(cls, ticker, metrics):
+        return cls(ticker, [str(p) for p in metrics.index], metrics.reindex(columns=list(cls.schema)).to_numpy(dtype=np.float64))
+    
+    def __len__(self):
+        return len(self.periods)
+    
+    def __repr__(self):
+        return f"MetricsRecord({self.ticker!r}, periods={len(self)})"
+    
+    # One metric across all periods
+    def __getitem__(self, metric):
+        return self.values[:, self.schema.index(metric)]
+    
+    @property
+    def nbytes(self):
+        return self.periods.nbytes + self.values.nbytes
+    
+    # Period labels as 'YYYY-MM-DD' strings
+    def period_labels(self):
+        return [str(p) for p in np.datetime_as_string(self.periods, unit='D')]
+    
+    # Metrics dataframe indexed by period, as returned by compute_ratios
+    def to_frame(self):
+        return pd.DataFrame(self.values, index=self.period_labels(), columns=list(self.schema))
+    
+    # Transposed dataframe with an Industry Average column, as shown in tables and exports
+    def to_display(self):
+        display = self.to_frame().transpose()
+        display['Industry Average'] = pd.Series(industry_averages)
+        return display
+    
+    # Fixed-layout binary form (period count, periods, values) for caches
+    def to_bytes(self):
+        return np.int64(len(self)).tobytes() + self.periods.astype(np.int64).tobytes() + self.values.tobytes()
+    
+    @classmethod
+    def from_bytes(cls, ticker, data):
+        count = int(np.frombuffer(data, dtype=np.int64, count=1)[0])
+        periods = np.frombuffer(data, dtype=np.int64, count=count, offset=8).astype('datetime64[D]')
+        values = np.frombuffer(data, dtype=np.float64, count=count * len(cls.schema), offset=8 + 8 * count)
+        return cls(ticker, periods, values.copy())
+
+# Seconds an update waits for other updates before the ratio table is written
+ratio_table_save_delay = float(os.environ.get('RATIO_TABLE_SAVE_DELAY', 2.0))
+
+# Columnar table of precomputed ratios covering every tracked ticker and period.
+# Each metric is a float64 column and every column keeps a sorted index (argsort),
+# so filters become binary searches and sorts become a walk over the index.
+class RatioTable:
+    # Comparison operators supported by screening filters
+    operators = ('>', '>=', '<', '<=', '==')
+    
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.records = {}  # ticker -> MetricsRecord
+        self.pending = set()  # tickers updated here since the last save
+        self.save_timer = None  # scheduled save batching the updates of the next few seconds
+        self.stamp = None  # (mtime, size) of the file when last loaded or saved
+        self.dirty = False
+        self.tickers = np.array([], dtype=object)
+        self.periods = np.array([], dtype='datetime64[D]')
+        self.values = np.empty((0, len(metric_names)))
+        self.latest = np.array([], dtype=bool)
+        self.sorted_index = {name: np.array([], dtype=np.int64) for name in metric_names}
+        
+        if path and os.path.exists(path):
+            self.load()
+    
+    def __len__(self):
+        self.build()
+        return len(self.tickers)
+    
+    # Replace all rows for a ticker with a MetricsRecord (or a metrics dataframe indexed by period)
+    # and, unless save is False, schedule a save so other worker processes see the change.
+    # Updates made within ratio_table_save_delay seconds are written together.
+    def update(self, ticker, metrics, save=True):
+        record = metrics if isinstance(metrics, MetricsRecord) else MetricsRecord.from_frame(ticker, metrics)
+        with self.lock:
+            self.records[ticker] = record
+            self.pending.add(ticker)
+            self.dirty = True
+            if save and self.path and self.save_timer is None:
+                self.save_timer = threading.Timer(ratio_table_save_delay, self.save)
+                self.save_timer.daemon = True
+                self.save_timer.start()
+    
+    def get(self, ticker):
+        self.sync()
+        return self.records.get(ticker)
+    
+    def file_stamp(self):
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+    
+    # Reload the file when another process has saved it since it was last read or written here
+    def sync(self):
+        if not self.path:
+            return
+        try:
+            stamp = self.file_stamp()
+        except FileNotFoundError:
+            return
+        if stamp != self.stamp:
+            self.load()
+    
+    # Rebuild the columns and sorted indexes after writes
+    def build(self):
+        self.sync()
+        with self.lock:
+            if not self.dirty:
+                return
+            
+            records = [record for record in self.records.values() if len(record)]
+            if records:
+                tickers = np.concatenate([np.full(len(r), r.ticker, dtype=object) for r in records])
+                periods = np.concatenate([r.periods for r in records])
+                values = np.vstack([r.values for r in records])
+                latest = np.concatenate([r.periods == r.periods.max() for r in records])
+            else:
+                tickers = np.array([], dtype=object)
+                periods = np.array([], dtype='datetime64[D]')
+                values = np.empty((0, len(metric_names)))
+                latest = np.array([], dtype=bool)
+            
+            # argsort places NaN last, which the query code relies on
+            sorted_index = {name: np.argsort(values[:, i], kind='stable') for i, name in enumerate(metric_names)}
+            
+            # Swap in the new arrays together so readers never see a partial build
+            self.tickers, self.periods, self.values, self.latest, self.sorted_index = (
+                tickers, periods, values, latest, sorted_index)
+            self.dirty = False
+    
+    # Rows of the sorted index that satisfy "metric <op> value"
+    def _filter_rows(self, values, sorted_index, metric, op, value):
+        if metric not in metric_names:
+            raise ValueError(f"Unknown metric: {metric}")
+        if op not in self.operators:
+            raise ValueError(f"Unsupported operator: {op}")
+        
+        order = sorted_index[metric]
+        column = values[order, metric_names.index(metric)]
+        valid = len(column) - int(np.isnan(column).sum())
+        column = column[:valid]
+        
+        if op == '>':
+            return order[np.searchsorted(column, value, side='right'):valid]
+        elif op == '>=':
+            return order[np.searchsorted(column, value, side='left'):valid]
+        elif op == '<':
+            return order[:np.searchsorted(column, value, side='left')]
+        elif op == '<=':
+            return order[:np.searchsorted(column, value, side='right')]
+        else:
+            return order[np.searchsorted(column, value, side='left'):np.searchsorted(column, value, side='right')]
+    
+    # Filter, sort and limit the table
+    # filters is a list of (metric, operator, value) tuples
+    def query(self, filters=(), sort_by=None, descending=True, limit=None, latest_only=True):
+        self.build()
+        tickers, periods, values, latest, sorted_index = (
+            self.tickers, self.periods, self.values, self.latest, self.sorted_index)
+        
+        mask = latest.copy() if latest_only else np.ones(len(tickers), dtype=bool)
+        for metric, op, value in filters:
+            selected = np.zeros(len(tickers), dtype=bool)
+            selected[self._filter_rows(values, sorted_index, metric, op, float(value))] = True
+            mask &= selected
+        
+        if sort_by is not None:
+            if sort_by not in metric_names:
+                raise ValueError(f"Unknown metric: {sort_by}")
+            order = sorted_index[sort_by]
+            if descending:
+                # Reverse the non-NaN part only so missing values stay last
+                valid = len(order) - int(np.isnan(values[order, metric_names.index(sort_by)]).sum())
+                order = np.concatenate([order[:valid][::-1], order[valid:]])
+            rows = order[mask[order]]
+        else:
+            rows = np.flatnonzero(mask)
+        
+        if limit is not None:
+            rows = rows[:int(limit)]
+        
+        return [
+            {'ticker': tickers[i], 'period': str(periods[i]),
+             'metrics': {name: (None if np.isnan(v) else float(v)) for name, v in zip(metric_names, values[i])}}
+            for i in rows
+        ]
+    
+    # Persist the table as an .npz file (written atomically). Under the lock file the
+    # latest saved table is merged in first, so rows saved by other workers are kept.
+    def save(self):
+        with self.lock:
+            if self.save_timer is not None:
+                self.save_timer.cancel()
+                self.save_timer = None
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + '.lock', 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            with self.lock:
+                saved = set(self.pending)
+            self.build()
+            tmp_path = self.path + f'.{os.getpid()}.{threading.get_ident()}.tmp.npz'
+            np.savez(tmp_path,
+                                tickers=self.tickers.astype(str),
+                                periods=np.datetime_as_string(self.periods, unit='D'),
+                                values=self.values,
+                                metric_names=np.array(metric_names))
+            os.replace(tmp_path, self.path)
+            with self.lock:
+                self.pending -= saved
+            self.stamp = self.file_stamp()
+    
+    # Load the saved table, keeping rows updated here that have not been saved yet
+    def load(self):
+        stamp = self.file_stamp()
+        with np.load(self.path, allow_pickle=False) as data:
+            stored_names = list(data['metric_names'])
+            tickers, periods = data['tickers'], data['periods']
+            values = pd.DataFrame(data['values'], columns=stored_names).reindex(columns=metric_names).to_numpy()
+        
+        # Group the rows by ticker with one sort instead of a scan per ticker
+        names, inverse = np.unique(tickers, return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        periods = periods.astype('datetime64[D]')
+        records = {}
+        for ticker, rows in zip(names, np.split(order, np.cumsum(np.bincount(inverse, minlength=len(names)))[:-1])):
+            records[str(ticker)] = MetricsRecord(str(ticker), periods[rows], values[rows])
+        with self.lock:
+            records.update({ticker: self.records[ticker] for ticker in self.pending})
+            self.records = records
+            self.stamp = stamp
+            self.dirty = True
+
+ratio_table = RatioTable(os.path.join(DATA_DIR, 'ratio_table.npz'))
+
+# Write updates that are still waiting for their scheduled save when the worker exits
+atexit.register(lambda: ratio_table.save() if ratio_table.pending else None)
+
+# Recompute the ratio table for a set of tickers (defaults to every tracked company)
+def refresh_ratio_table(tickers=None, years_back=5):
+    errors = {}
+    for ticker in (tickers or list(companies.keys())):
+        try:
+            company_info, balance_sheet, income_stmt, cash_flow = fetch_annual_history(ticker)
+            error = update_ratio_record(ticker, company_info, balance_sheet, income_stmt, cash_flow, years_back, save=False)
+            if error:
+                errors[ticker] = error
+        except Exception as e:
+            errors[ticker] = str(e)
+    
+    ratio_table.save()
+    score_store.refresh()
+    return errors
+
+# Function to recompute one ticker's annual ratios into the table; returns an error or None
+def update_ratio_record(ticker, company_info, balance_sheet, income_stmt, cash_flow, years_back=5, save=True):
+    balance_history = balance_sheet
+    balance_sheet, income_stmt, cash_flow = align_statements(balance_sheet, income_stmt, cash_flow, years_back)
+    pack_name, error = resolve_metric_pack(company_info, balance_sheet, income_stmt)
+    if pack_name is None:
+        return error
+    metrics, error = compute_ratios(balance_sheet, income_stmt, pack=metric_packs[pack_name], balance_history=balance_history)
+    if metrics is None:
+        return error
+    ratio_table.update(ticker, metrics, save)
+    return None
+
+# Radar category scores of every (ticker, fiscal period) in the ratio table, kept in the
+# snapshot database for score history and rankings. Scores for many records are computed
+# with one radar_score_matrix call over their stacked ratio arrays.
+class ScoreStore:
+    columns = {'Liquidity': 'liquidity', 'Efficiency': 'efficiency', 'Profitability': 'profitability',
+               'Solvency': 'solvency', 'Overall': 'overall'}
+    
+    def __init__(self, path):
+        self.path = path
+        self.initialized = False
+        self.init_lock = threading.Lock()
+    
+    def connect(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        if not self.initialized:
+            with self.init_lock:
+                connection.execute('PRAGMA journal_mode=WAL')
+                connection.execute('''
+                    CREATE TABLE IF NOT EXISTS radar_scores (
+                        ticker TEXT NOT NULL,
+                        fiscal_date TEXT NOT NULL,
+                        liquidity REAL,
+                        efficiency REAL,
+                        profitability REAL,
+                        solvency REAL,
+                        overall REAL,
+                        computed_at TEXT NOT NULL,
+                        PRIMARY KEY (ticker, fiscal_date)
+                    ) WITHOUT ROWID
+                ''')
+                connection.commit()
+                self.initialized = True
+        return connection
+    
+    # Score and store a list of MetricsRecords
+    def record(self, records):
+        records = [record for record in records if record is not None and len(record)]
+        if not records:
+            return 0
+        values = np.vstack([record.values for record in records])
+        scores = radar_score_matrix(values)
+        reported = ~np.isnan(scores)
+        overall = np.divide(np.where(reported, scores, 0.0).sum(axis=1), reported.sum(axis=1),
+                            out=np.full(len(scores), np.nan), where=reported.any(axis=1))
+        scores = np.column_stack([scores, overall])
+        
+        tickers = [record.ticker for record in records for _ in range(len(record))]
+        periods = [period for record in records for period in record.period_labels()]
+        computed_at = datetime.now().isoformat(timespec='seconds')
+        rows = [(ticker, period, *[None if np.isnan(v) else float(v) for v in row], computed_at)
+                for ticker, period, row in zip(tickers, periods, scores)]
+        
+        connection = self.connect()
+        try:
+            with connection:
+                connection.executemany('''
+                    INSERT INTO radar_scores VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (ticker, fiscal_date) DO UPDATE SET
+                        liquidity = excluded.liquidity, efficiency = excluded.efficiency,
+                        profitability = excluded.profitability, solvency = excluded.solvency,
+                        overall = excluded.overall, computed_at = excluded.computed_at
+                ''', rows)
+        finally:
+            connection.close()
+        return len(rows)
+    
+    # Rescore every ticker held by the ratio table
+    def refresh(self):
+        return self.record(list(ratio_table.records.values()))
+    
+    def query(self, sql, params):
+        connection = self.connect()
+        try:
+            cursor = connection.execute(sql, params)
+            names = [column[0] for column in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+        finally:
+            connection.close()
+    
+    # Stored scores of one ticker, most recent period first
+    def history(self, ticker):
+        return self.query('SELECT * FROM radar_scores WHERE ticker = ? ORDER BY fiscal_date DESC', (ticker,))
+    
+    # Tickers ranked on a category using each ticker's latest scored period
+    def rankings(self, category='Overall', limit=50, descending=True):
+        if category not in self.columns:
+            raise ValueError(f"Unknown category: {category}")
+        column = self.columns[category]
+        return self.query(f'''
+            SELECT s.* FROM radar_scores s
+            JOIN (SELECT ticker, MAX(fiscal_date) AS fiscal_date FROM radar_scores GROUP BY ticker) latest
+            USING (ticker, fiscal_date)
+            WHERE s.{column} IS NOT NULL
+            ORDER BY s.{column} {'DESC' if descending else 'ASC'}
+            LIMIT ?
+        ''', (int(limit),))
+
+score_store = ScoreStore(os.path.join(DATA_DIR, 'snapshots.db'))
+
+# Function to compute metrics, market data and charts from already fetched statements
+# periods limits the number of (most recent) statement dates used
+# With stream=True the chart data is returned as an iter_charts generator instead of a dict,
+# with charts=False no charts are built (an empty dict is returned), and with save_table=False
+# the ratio table update is left for the caller to save
+def analyze_statements(ticker, company_info, balance_sheet, income_stmt, cash_flow, periods,
+                       average_periods=2, period_label='Year', update_table=True, stream=False,
+                       charts=True, save_table=True):
+    # Restrict the statements to their common dates (the turnover averages use the full balance sheet)
+    balance_history = balance_sheet
+    balance_sheet, income_stmt, cash_flow = align_statements(balance_sheet, income_stmt, cash_flow, periods)
+    
+    # Pick the sector metric pack, failing fast when its line items are missing
+    pack_name, error = resolve_metric_pack(company_info, balance_sheet, income_stmt)
+    if pack_name is None:
+        return None, None, None, None, error, None
+    pack = metric_packs[pack_name]
+    
+    # Calculate the ratio pack
+    diagnostics = {'metric_pack': pack_name}
+    metrics, error = compute_ratios(balance_sheet, income_stmt, average_periods, diagnostics, pack, balance_history)
+    if metrics is None:
+        return None, None, None, None, error, None
+    sector_metrics = compute_pack_metrics(pack, balance_sheet, income_stmt, average_periods, balance_history)
+    
+    # Keep the screening table up to date with the freshly computed annual ratios
+    record = MetricsRecord.from_frame(ticker, metrics)
+    if update_table:
+        ratio_table.update(ticker, record, save_table)
+        try:
+            score_store.record([record])
+        except sqlite3.Error as store_error:
+            print(f"Score store error for {ticker}: {store_error}")
+    
+    # Add price-based market metrics; missing prices should not fail the analysis
+    try:
+        market_metrics, market_history = compute_market_metrics(ticker, metrics.index, balance_sheet, income_stmt, company_info)
+    except Exception as market_error:
+        print(f"Market data error for {ticker}: {market_error}")
+        market_metrics, market_history = pd.DataFrame(index=metrics.index, columns=market_metric_names, dtype=np.float64), None
+    
+    # Transpose the metrics for better display (with the industry averages column)
+    sector_display = sector_metrics.transpose()
+    sector_display['Industry Average'] = pd.Series(pack['benchmarks'], dtype=np.float64)
+    metrics_display = pd.concat([record.to_display(), sector_display, market_metrics.transpose()])
+    
+    # Keep the data-quality provenance with the metrics so it travels with cached results
+    diagnostics['ticker'] = ticker
+    metrics_display.attrs['diagnostics'] = diagnostics
+    
+    # Create chart data
+    if not charts:
+        chart_data = {}
+    elif stream:
+        chart_data = iter_charts(ticker, metrics, period_label, market_history)
+    else:
+        chart_data = build_charts(ticker, metrics, period_label, market_history)
+    
+    # Return the financial data and calculated metrics
+    return balance_sheet, income_stmt, cash_flow, metrics_display, chart_data, company_info
+
+# Opt-in profiling. A request is profiled when it passes profile=1 (or an X-Profile: 1
+# header) or when it is picked by the PROFILE_SAMPLE_RATE sampler; its calculate_metrics
+# run and export build are then captured with cProfile and tracemalloc. The slowest
+# PROFILE_KEEP captures are kept per worker process for the /admin/profiles endpoints.
+profile_sample_rate = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+profile_keep = int(os.environ.get('PROFILE_KEEP', 20))
+profile_top_functions = 40
+profile_top_allocations = 20
+
+# Admin endpoints and explicit profiling require this token; with no ADMIN_TOKEN
+# configured they are disabled (sampled profiling still runs)
+admin_token = os.environ.get('ADMIN_TOKEN')
+
+def admin_authorized():
+    if not admin_token:
+        return False
+    supplied = request.headers.get('X-Admin-Token') or request.args.get('token') or ''
+    return hmac.compare_digest(supplied, admin_token)
+
+# Function to decide (once per request) whether the current request is profiled
+def profiling_requested():
+    if not has_request_context():
+        return False
+    if 'profile' not in g:
+        opted_in = (request.values.get('profile') in ('1', 'true') or request.headers.get('X-Profile') == '1') and admin_authorized()
+        g.profile = opted_in or (profile_sample_rate > 0 and random.random() < profile_sample_rate)
+    return g.profile
+
+# One cProfile + tracemalloc capture. tracemalloc is process-wide, so only one
+# capture runs at a time; sections started while another is active are not profiled.
+class ProfileSession:
+    active = threading.Lock()
+    ids = itertools.count(1)
+    
+    def __init__(self, ticker, operation):
+        self.ticker = ticker
+        self.operation = operation
+        self.captured_at = datetime.now()
+        self.started_tracing = not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        self.profile = cProfile.Profile()
+        try:
+            self.profile.enable()
+        except ValueError:
+            self.profile = None  # another profiler (e.g. a debugger) owns the hook
+        self.start = time.perf_counter()
+    
+    @classmethod
+    def begin(cls, ticker, operation):
+        if not profiling_requested() or not cls.active.acquire(blocking=False):
+            return None
+        try:
+            return cls(ticker, operation)
+        except Exception:
+            cls.active.release()
+            raise
+    
+    def finish(self):
+        try:
+            duration = time.perf_counter() - self.start
+            if self.profile is not None:
+                self.profile.disable()
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+            ])
+            peak = tracemalloc.get_traced_memory()[1]
+            if self.started_tracing:
+                tracemalloc.stop()
+        finally:
+            ProfileSession.active.release()
+        
+        # Text report: hottest functions by cumulative time, then the largest allocation sites
+        report = io.StringIO()
+        report.write(f"{self.operation} for {self.ticker} at {self.captured_at:%Y-%m-%d %H:%M:%S}: "
+                     f"{duration:.3f}s, peak traced memory {peak / 1024 / 1024:.1f} MiB\n\n")
+        raw = b''
+        if self.profile is not None:
+            stats = pstats.Stats(self.profile, stream=report)
+            stats.sort_stats('cumulative').print_stats(profile_top_functions)
+            raw = marshal.dumps(stats.stats)
+        report.write('Top allocations\n')
+        for statistic in snapshot.statistics('lineno')[:profile_top_allocations]:
+            report.write(f"{statistic}\n")
+        
+        profile_store.add({
+            'id': next(self.ids),
+            'ticker': self.ticker,
+            'operation': self.operation,
+            'captured_at': self.captured_at.isoformat(timespec='seconds'),
+            'duration': duration,
+            'peak_memory': peak,
+            'report': report.getvalue(),
+            'stats': raw,
+        })
+
+# Context manager profiling a block when the current request asked for it
+@contextmanager
+def profiled(ticker, operation):
+    session = ProfileSession.begin(ticker, operation)
+    try:
+        yield
+    finally:
+        if session is not None:
+            session.finish()
+
+# Request-scoped variant for long view code: ended by end_profile or at teardown
+def begin_profile(ticker, operation):
+    g.profile_session = ProfileSession.begin(ticker, operation)
+
+@app.teardown_request
+def end_profile(error=None):
+    session = g.pop('profile_session', None)
+    if session is not None:
+        session.finish()
+
+# The N slowest captures, kept in a min-heap on duration so the fastest is evicted first
+class ProfileStore:
+    def __init__(self, keep):
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.entries = []  # (duration, id, entry)
+    
+    def add(self, entry):
+        item = (entry['duration'], entry['id'], entry)
+        with self.lock:
+            if len(self.entries) < self.keep:
+                heapq.heappush(self.entries, item)
+            elif item[0] > self.entries[0][0]:
+                heapq.heapreplace(self.entries, item)
+    
+    # Capture summaries, slowest first
+    def summaries(self):
+        with self.lock:
+            entries = sorted(self.entries, reverse=True)
+        return [{key: value for key, value in entry.items() if key not in ('report', 'stats')}
+                for _, _, entry in entries]
+    
+    def get(self, profile_id):
+        with self.lock:
+            return next((entry for _, _, entry in self.entries if entry['id'] == profile_id), None)
+
+profile_store = ProfileStore(profile_keep)
+
+# Function to calculate financial metrics
+# In quarterly mode income statement figures are trailing twelve months and
+# turnover ratios average the five quarter-end balances spanning that year
+def calculate_metrics(ticker, years_back=5, frequency='annual'):
+    with profiled(ticker, 'calculate_metrics'):
+        try:
+            # Get financial data
+            company_info, balance_sheet, income_stmt, cash_flow, options = fetch_for_analysis(ticker, years_back, frequency)
+            return analyze_statements(ticker, company_info, balance_sheet, income_stmt, cash_flow, **options)
             
-            fig5.update_layout(
-                title={
-                    'text': 'Days Sales Outstanding',
-                    'y':0.9,
-                    'x':0.5,
-                    'xanchor': 'center',
-                    'yanchor': 'top',
-                    'font': dict(size=22)
-                },
-                xaxis_title='Year',
-                yaxis_title='Days',
-                legend=dict(
-                    orientation="h",
-                    yanchor="bottom",
-                    y=1.02,
-                    xanchor="right",
-                    x=1
-                ),
-                template='plotly_white',
-                height=500,
-                margin=dict(l=60, r=40, t=80, b=60)  # Add appropriate margins
-            )
-            chart_data['dso'] = json.dumps(fig5, cls=plotly.utils.PlotlyJSONEncoder)
-        
-        # Radar Chart for Comparative Overview
-        categories = ['Liquidity', 'Efficiency', 'Profitability', 'Solvency']
-        
-        # Use the most recent values
-        recent = metrics.iloc[0]
-        
-        # Convert metrics to a normalized scale for radar chart
-        # For Current Ratio and Quick Ratio, higher is better (up to a point)
-        current_ratio_norm = min(recent['Current Ratio'] / industry_averages['Current Ratio'], 2)
-        quick_ratio_norm = min(recent['Quick Ratio'] / industry_averages['Quick Ratio'], 2)
-        
-        # For turnovers, higher is generally better
-        current_asset_turnover_norm = recent['Current Asset Turnover'] / industry_averages['Current Asset Turnover']
-        total_asset_turnover_norm = recent['Total Asset Turnover'] / industry_averages['Total Asset Turnover']
-        
-        # For DSO, lower is better (inverted)
-        if recent['Days Sales Outstanding'] > 0:
-            dso_norm = industry_averages['Days Sales Outstanding'] / max(recent['Days Sales Outstanding'], 1)
-        else:
-            dso_norm = 1
-        
-        # For profitability, higher is better
-        profit_margin_norm = recent['Profit Margin'] / max(industry_averages['Profit Margin'], 0.01)
-        roe_norm = recent['Return on Equity'] / max(industry_averages['Return on Equity'], 0.01)
-        bep_norm = recent['Basic Earning Power'] / max(industry_averages['Basic Earning Power'], 0.01)
-        
-        # For debt ratio, lower is generally better (inverted)
-        debt_ratio_norm = 2 - (recent['Debt Ratio'] / industry_averages['Debt Ratio'])
-        
-        # Average metrics by category
-        liquidity_avg = (current_ratio_norm + quick_ratio_norm) / 2
-        efficiency_avg = (current_asset_turnover_norm + total_asset_turnover_norm + dso_norm) / 3
-        profitability_avg = (profit_margin_norm + roe_norm + bep_norm) / 3
-        solvency_avg = debt_ratio_norm
+        except Exception as e:
+            return None, None, None, None, str(e), None
+
+# Function to fetch the statements for an analysis along with the analyze_statements options
+def fetch_for_analysis(ticker, years_back=5, frequency='annual', company_info=None):
+    if frequency == 'quarterly':
+        company_info, balance_sheet, income_stmt, cash_flow = fetch_financials(ticker, frequency, company_info)
+        income_stmt = trailing_twelve_months(ticker, income_stmt)
+        options = dict(periods=years_back * 4, average_periods=5, period_label='Quarter (TTM)', update_table=False)
+    else:
+        company_info, balance_sheet, income_stmt, cash_flow = fetch_annual_history(ticker, company_info)
+        options = dict(periods=years_back)
+    return company_info, balance_sheet, income_stmt, cash_flow, options
+
+# Function to calculate metrics over a stored fiscal date range without contacting Yahoo
+# for statements; start and end are 'YYYY-MM-DD' strings (either may be None)
+def calculate_history_metrics(ticker, start=None, end=None):
+    try:
+        balance_sheet, income_stmt, cash_flow = snapshot_store.history(ticker, start, end)
+        if balance_sheet.empty:
+            return None, None, None, None, f"No stored statements for {ticker} in the requested range", None
         
-        # Create radar chart
-        fig6 = go.Figure()
+        return analyze_statements(ticker, None, balance_sheet, income_stmt, cash_flow, len(balance_sheet.columns),
+                                  update_table=False)
         
-        fig6.add_trace(go.Scatterpolar(
-            r=[liquidity_avg, efficiency_avg, profitability_avg, solvency_avg],
+    except Exception as e:
+        return None, None, None, None, str(e), None
+
+# What-if drivers, each a fractional change (0.1 = +10%) applied to the latest period.
+# Net income and EBIT move with revenue at constant margins before their own change;
+# inventory and receivables changes flow into current and total assets; 'refinance'
+# moves that fraction of current liabilities into long-term debt.
+scenario_drivers = ['revenue', 'net_income', 'ebit', 'inventory', 'receivables',
+                    'current_liabilities', 'total_liabilities', 'equity', 'refinance']
+
+# Upper bound on the number of scenarios evaluated in one request
+max_scenarios = int(os.environ.get('MAX_SCENARIOS', 200000))
+
+# Upper bound on the number of scenarios returned value by value in one response;
+# every scenario is still covered by the per-ratio summary
+max_scenario_values = int(os.environ.get('MAX_SCENARIO_VALUES', 1000))
+
+# Function to extract the base statement values of one period for the scenario engine
+# Returns a dict of floats (NaN for items its metric pack does not require) or raises ValueError
+def scenario_base(balance_sheet, income_stmt, period=None, company_info=None):
+    balance_sheet, income_stmt, _ = align_statements(balance_sheet, income_stmt, balance_sheet, len(balance_sheet.columns))
+    dates = list(balance_sheet.columns)
+    if not dates:
+        raise ValueError("No statement periods available")
+    position = dates.index(period) if period in dates else 0
+    
+    # Only the line items of the company's metric pack are required
+    pack_name, error = resolve_metric_pack(company_info, balance_sheet, income_stmt)
+    if pack_name is None:
+        raise ValueError(error)
+    required = metric_packs[pack_name]['required']
+    
+    def value(df, item, required=False, column=position):
+        row = find_row(df, row_aliases[item])
+        if row is None or column >= len(row):
+            if required:
+                raise ValueError(f"Could not find {item} in statements")
+            return np.nan
+        return float(row.iloc[column])
+    
+    base = {'period': dates[position], 'metric_pack': pack_name}
+    for item, key in (('Current Assets', 'current_assets'), ('Current Liabilities', 'current_liabilities'),
+                      ('Total Assets', 'total_assets'), ('Stockholder Equity', 'equity')):
+        base[key] = value(balance_sheet, item, required=item in required)
+    for item, key in (('Revenue', 'revenue'), ('Net Income', 'net_income')):
+        base[key] = value(income_stmt, item, required=item in required)
+    base['inventory'] = value(balance_sheet, 'Inventory')
+    base['receivables'] = value(balance_sheet, 'Accounts Receivable')
+    
+    # Same fallbacks as compute_ratios
+    base['total_liabilities'] = value(balance_sheet, 'Total Liabilities')
+    if np.isnan(base['total_liabilities']):
+        base['total_liabilities'] = base['total_assets'] - base['equity']
+    base['ebit'] = value(income_stmt, 'EBIT')
+    if np.isnan(base['ebit']):
+        base['ebit'] = (base['net_income']
+                        + np.nan_to_num(value(income_stmt, 'Interest Expense'))
+                        + np.nan_to_num(value(income_stmt, 'Income Tax')))
+    
+    # Prior period balances for the turnover averages (the period itself if there is none)
+    prior = position + 1 if position + 1 < len(dates) else position
+    base['prior_current_assets'] = value(balance_sheet, 'Current Assets', column=prior)
+    base['prior_total_assets'] = value(balance_sheet, 'Total Assets', column=prior)
+    return base
+
+# Function to build the cartesian product of driver values as flat arrays
+# ranges maps driver -> list of values; drivers not given stay at 0 (no change)
+def build_scenario_grid(ranges):
+    unknown = set(ranges) - set(scenario_drivers)
+    if unknown:
+        raise ValueError(f"Unknown scenario drivers: {', '.join(sorted(unknown))}")
+    
+    names = [d for d in scenario_drivers if d in ranges]
+    axes = [np.atleast_1d(np.asarray(ranges[d], dtype=np.float64)) for d in names]
+    count = int(np.prod([len(axis) for axis in axes])) if axes else 1
+    if count > max_scenarios:
+        raise ValueError(f"Too many scenarios ({count}); the limit is {max_scenarios}")
+    
+    mesh = np.meshgrid(*axes, indexing='ij') if axes else []
+    return {d: grid.ravel() for d, grid in zip(names, mesh)}
+
+# Function to evaluate the ratio pack for every scenario in one broadcast over the base values
+# grid maps driver -> array of changes (all the same length); returns metric -> array
+def evaluate_scenarios(base, grid):
+    count = max([len(np.atleast_1d(v)) for v in grid.values()] or [1])
+    changes = {d: np.broadcast_to(np.asarray(grid.get(d, 0.0), dtype=np.float64), (count,)) for d in scenario_drivers}
+    
+    revenue = base['revenue'] * (1 + changes['revenue'])
+    net_income = base['net_income'] * (1 + changes['revenue']) * (1 + changes['net_income'])
+    ebit = base['ebit'] * (1 + changes['revenue']) * (1 + changes['ebit'])
+    
+    inventory = np.nan_to_num(base['inventory']) * (1 + changes['inventory'])
+    receivables = base['receivables'] * (1 + changes['receivables'])
+    asset_change = (inventory - np.nan_to_num(base['inventory'])) + np.nan_to_num(receivables - base['receivables'])
+    current_assets = base['current_assets'] + asset_change
+    total_assets = base['total_assets'] + asset_change
+    
+    current_liabilities = base['current_liabilities'] * (1 + changes['current_liabilities'] - changes['refinance'])
+    total_liabilities = base['total_liabilities'] * (1 + changes['total_liabilities'])
+    equity = base['equity'] * (1 + changes['equity'])
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        current_ratio = current_assets / current_liabilities
+        results = {
+            'Current Ratio': current_ratio,
+            'Quick Ratio': current_ratio if np.isnan(base['inventory']) else (current_assets - inventory) / current_liabilities,
+            'Current Asset Turnover': revenue / ((current_assets + base['prior_current_assets']) / 2),
+            'Total Asset Turnover': revenue / ((total_assets + base['prior_total_assets']) / 2),
+            'Days Sales Outstanding': receivables / (revenue / 365),
+            'Profit Margin': net_income / revenue,
+            'Debt Ratio': total_liabilities / total_assets,
+            'Return on Equity': net_income / equity,
+            'Basic Earning Power': ebit / total_assets
+        }
+    for metric in metric_packs[base.get('metric_pack', 'General')]['not_applicable']:
+        results[metric] = np.full(count, np.nan)
+    return results
+
+# Function to summarize one ratio over all scenarios (finite values only; None when there are none)
+def scenario_summary(values):
+    values = values[np.isfinite(values)]
+    if not len(values):
+        return {key: None for key in ('min', 'p5', 'median', 'p95', 'max', 'mean')}
+    low, p5, median, p95, high = np.percentile(values, [0, 5, 50, 95, 100])
+    return {'min': float(low), 'p5': float(p5), 'median': float(median), 'p95': float(p95),
+            'max': float(high), 'mean': float(values.mean())}
+
+# Cached scenario base values per (ticker, period) so slider updates skip statement loading
+scenario_bases = OrderedDict()
+scenario_bases_lock = threading.Lock()
+
+# Function to get scenario base values, preferring locally stored statements over Yahoo
+def get_scenario_base(ticker, period=None):
+    key = (ticker, period)
+    with scenario_bases_lock:
+        if key in scenario_bases:
+            scenario_bases.move_to_end(key)
+            return scenario_bases[key]
+    
+    company_info = None  # without it the metric pack is picked from the available rows
+    balance_sheet, income_stmt, cash_flow = snapshot_store.history(ticker)
+    if balance_sheet.empty:
+        company_info, balance_sheet, income_stmt, cash_flow = fetch_annual_history(ticker)
+    base = scenario_base(balance_sheet, income_stmt, period, company_info)
+    
+    with scenario_bases_lock:
+        scenario_bases[key] = base
+        while len(scenario_bases) > 1000:
+            scenario_bases.popitem(last=False)
+    return base
+
+# Helper function to turn an array into a JSON list (JSON has no NaN/inf, so those become null)
+def json_values(values):
+    values = np.asarray(values, dtype=np.float64)
+    cleaned = values.astype(object)
+    cleaned[~np.isfinite(values)] = None
+    return cleaned.tolist()
+
+# Upper bound on the number of holdings in one portfolio request, and the number of
+# (largest) holdings drawn as their own lines in the portfolio charts
+max_portfolio_holdings = int(os.environ.get('MAX_PORTFOLIO_HOLDINGS', 500))
+portfolio_chart_holdings = int(os.environ.get('PORTFOLIO_CHART_HOLDINGS', 10))
+
+# Function to validate {ticker: weight} holdings; returns tickers and weights summing to one
+def normalize_holdings(holdings):
+    if not holdings:
+        raise ValueError("No holdings given")
+    if len(holdings) > max_portfolio_holdings:
+        raise ValueError(f"At most {max_portfolio_holdings} holdings are supported")
+    tickers = [ticker.strip().upper() for ticker in holdings]
+    weights = np.array([float(weight) for weight in holdings.values()])
+    if not np.isfinite(weights).all() or (weights < 0).any():
+        raise ValueError("Weights must be non-negative numbers")
+    if weights.sum() <= 0:
+        raise ValueError("At least one weight must be positive")
+    return tickers, weights / weights.sum()
+
+# Function to get the MetricsRecord of each holding from the ratio table,
+# computing (and caching) only the tickers it does not hold yet
+def portfolio_records(tickers, years_back=5):
+    records = []
+    for ticker in tickers:
+        record = ratio_table.get(ticker)
+        if record is None:
+            balance_sheet, income_stmt, cash_flow, metrics, chart_data, company_info = cached_calculate_metrics(ticker, years_back)
+            if metrics is None:
+                raise ValueError(f"{ticker}: {chart_data}")  # chart_data contains error message
+            # A result cached by another worker did not pass through this process's table
+            record = ratio_table.get(ticker)
+            if record is None:
+                core = metrics.loc[list(MetricsRecord.schema)].drop(columns='Industry Average')
+                record = MetricsRecord.from_frame(ticker, core.transpose())
+                ratio_table.update(ticker, record)
+        records.append(record)
+    return records
+
+# Function to aggregate holdings in one pass over a [holdings, years, metrics] array.
+# Periods are aligned on fiscal year. Each ratio is the weighted mean over the holdings
+# that report it that year (weights renormalized per cell), and a holding's contribution
+# is its share of that mean, so contributions add up to the portfolio value.
+def aggregate_portfolio(records, weights, years_back=5):
+    fiscal_years = [record.periods.astype('datetime64[Y]') for record in records]
+    years = np.unique(np.concatenate(fiscal_years))[::-1][:years_back]  # newest first
+    
+    values = np.full((len(records), len(years), len(MetricsRecord.schema)), np.nan)
+    ascending = years[::-1]
+    for i, (record, record_years) in enumerate(zip(records, fiscal_years)):
+        position = np.searchsorted(ascending, record_years)
+        keep = (position < len(ascending)) & (ascending[np.minimum(position, len(ascending) - 1)] == record_years)
+        values[i, len(years) - 1 - position[keep]] = record.values[keep]
+    
+    w = weights[:, None, None]
+    reported = ~np.isnan(values)
+    covered = (w * reported).sum(axis=0)
+    weighted = np.where(reported, values * w, 0.0)
+    aggregate = np.divide(weighted.sum(axis=0), covered, out=np.full(covered.shape, np.nan), where=covered > 0)
+    contributions = np.divide(weighted, covered, out=np.full(weighted.shape, np.nan), where=(covered > 0) & reported)
+    
+    return {
+        'years': [str(year) for year in years],
+        'values': values,
+        'aggregate': aggregate,
+        'contributions': contributions,
+        'coverage': covered,
+    }
+
+# Function to build the portfolio charts: one radar trace per shown holding plus the
+# portfolio, and a trend chart with a dropdown to switch between ratios. Only the
+# portfolio_chart_holdings largest holdings get their own lines; the portfolio line
+# always covers every holding.
+def portfolio_charts(tickers, weights, records, result):
+    categories = radar_categories
+    colors = px.colors.qualitative.Plotly
+    shown = np.sort(np.argsort(-weights, kind='stable')[:portfolio_chart_holdings])
+    
+    # Score each shown holding's latest period and the portfolio in one pass
+    latest = np.vstack([records[i].values[np.argmax(records[i].periods)] for i in shown] + [result['aggregate'][0]])
+    scores = radar_score_matrix(latest)
+    
+    radar = go.Figure()
+    for row, i in enumerate(shown):
+        radar.add_trace(go.Scatterpolar(
+            r=json_values(scores[row]),
             theta=categories,
-            fill='toself',
-            name=ticker,
-            line=dict(color='#1f77b4', width=3),
-            fillcolor='rgba(31, 119, 180, 0.3)'
+            name=tickers[i],
+            line=dict(color=colors[row % len(colors)], width=1.5)
         ))
-        
-        fig6.add_trace(go.Scatterpolar(
-            r=[1, 1, 1, 1],  # Industry baseline
-            theta=categories,
-            fill='toself',
-            name='Industry Average',
-            line=dict(color='#ff7f0e', width=2, dash='dash'),
-            fillcolor='rgba(255, 127, 14, 0.1)'
+    radar.add_trace(go.Scatterpolar(
+        r=json_values(scores[-1]),
+        theta=categories,
+        fill='toself',
+        name='Portfolio',
+        line=dict(color='#111111', width=3),
+        fillcolor='rgba(17, 17, 17, 0.15)'
+    ))
+    radar.add_trace(go.Scatterpolar(
+        r=[1, 1, 1, 1],  # Industry baseline
+        theta=categories,
+        name='Industry Average',
+        line=dict(color='#ff7f0e', width=2, dash='dash')
+    ))
+    radar.update_layout(
+        polar=dict(radialaxis=dict(visible=True, range=[0, 2])),
+        title={'text': 'Portfolio Performance Overview', 'y':0.95, 'x':0.5, 'xanchor': 'center', 'yanchor': 'top', 'font': dict(size=22)},
+        showlegend=True,
+        template='plotly_white',
+        height=650,
+        margin=dict(l=80, r=80, t=100, b=80)
+    )
+    
+    # Trend chart: for each ratio, one line per holding plus the portfolio line
+    years = result['years'][::-1]
+    trend = go.Figure()
+    buttons = []
+    traces_per_metric = len(shown) + 1
+    for m, name in enumerate(MetricsRecord.schema):
+        for row, i in enumerate(shown):
+            trend.add_trace(go.Scatter(
+                x=years, y=json_values(result['values'][i, ::-1, m]),
+                mode='lines+markers', name=tickers[i], visible=(m == 0), legendgroup=tickers[i],
+                line=dict(color=colors[row % len(colors)], width=1.5)
+            ))
+        trend.add_trace(go.Scatter(
+            x=years, y=json_values(result['aggregate'][::-1, m]),
+            mode='lines+markers', name='Portfolio', visible=(m == 0),
+            line=dict(color='#111111', width=3)
         ))
-        
-        fig6.update_layout(
-            polar=dict(
-                radialaxis=dict(
-                    visible=True,
-                    range=[0, 2]
-                )
-            ),
-            title={
-                'text': 'Financial Performance Overview',
-                'y':0.95,
-                'x':0.5,
-                'xanchor': 'center',
-                'yanchor': 'top',
-                'font': dict(size=22)
-            },
-            showlegend=True,
-            template='plotly_white',
-            height=650,  # Increased from 600
-            margin=dict(l=80, r=80, t=100, b=80)  # Add more margin space
-        )
-        chart_data['radar'] = json.dumps(fig6, cls=plotly.utils.PlotlyJSONEncoder)
-        
-        # Return the financial data and calculated metrics
-        return balance_sheet, income_stmt, cash_flow, metrics_display, chart_data, company_info
-        
-    except Exception as e:
-        return None, None, None, None, str(e), None
+        visible = [False] * (traces_per_metric * len(MetricsRecord.schema))
+        visible[m * traces_per_metric:(m + 1) * traces_per_metric] = [True] * traces_per_metric
+        buttons.append(dict(label=name, method='update', args=[{'visible': visible}, {'yaxis': {'title': name}}]))
+    trend.update_layout(
+        title={'text': 'Portfolio Ratio Trends', 'y':0.9, 'x':0.5, 'xanchor': 'center', 'yanchor': 'top', 'font': dict(size=22)},
+        updatemenus=[dict(buttons=buttons, direction='down', x=0, xanchor='left', y=1.15, yanchor='top')],
+        xaxis_title='Fiscal Year',
+        yaxis_title=MetricsRecord.schema[0],
+        template='plotly_white',
+        height=500,
+        margin=dict(l=60, r=40, t=100, b=60)
+    )
+    
+    return {
+        'radar': json.dumps(radar, cls=plotly.utils.PlotlyJSONEncoder),
+        'trend': json.dumps(trend, cls=plotly.utils.PlotlyJSONEncoder),
+    }
+
+# Shared result cache settings (slot count, bytes per slot, time to live in seconds)
+result_cache_slots = int(os.environ.get('RESULT_CACHE_SLOTS', 256))
+result_cache_slot_bytes = int(os.environ.get('RESULT_CACHE_SLOT_BYTES', 2 * 1024 * 1024))
+result_cache_ttl = float(os.environ.get('RESULT_CACHE_TTL', 3600))
+
+# Cache of computed results shared by every worker process on the host.
+# Entries live in fixed-size slots of a memory-mapped file (sparse, so unused
+# slots cost no memory); a key hashes to exactly one slot. Each slot header holds
+# a sequence number that writers make odd while writing, so readers never lock:
+# they copy the payload and treat it as a miss if the sequence number changed or
+# the CRC does not match. Writers serialize on an flock.
+class SharedResultCache:
+    header = struct.Struct('<QQdII')  # sequence, key hash, expires at, length, crc32
+    
+    def __init__(self, path, slots=result_cache_slots, slot_bytes=result_cache_slot_bytes, ttl=result_cache_ttl):
+        self.path = path
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.ttl = ttl
+        self.map = None
+        self.map_pid = None
+        self.open_lock = threading.Lock()
+        self.write_lock = threading.Lock()
+    
+    # Map the cache file (again after a fork, so each worker has its own mapping)
+    def mapping(self):
+        if self.map is not None and self.map_pid == os.getpid():
+            return self.map
+        with self.open_lock:
+            if self.map is None or self.map_pid != os.getpid():
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+                try:
+                    size = self.slots * self.slot_bytes
+                    if os.fstat(fd).st_size < size:
+                        os.ftruncate(fd, size)
+                    self.map = mmap.mmap(fd, size)
+                    self.map_pid = os.getpid()
+                finally:
+                    os.close(fd)
+        return self.map
+    
+    @staticmethod
+    def key_hash(key):
+        return int.from_bytes(hashlib.blake2b(repr(key).encode(), digest_size=8).digest(), 'little') or 1
+    
+    def get(self, key):
+        buffer = self.mapping()
+        key_hash = self.key_hash(key)
+        offset = (key_hash % self.slots) * self.slot_bytes
+        
+        sequence, stored_hash, expires_at, length, crc = self.header.unpack_from(buffer, offset)
+        if sequence % 2 or stored_hash != key_hash or expires_at < time.time() or length == 0:
+            return None
+        
+        start = offset + self.header.size
+        payload = buffer[start:start + length]
+        if self.header.unpack_from(buffer, offset)[0] != sequence or zlib.crc32(payload) != crc:
+            return None  # Overwritten while reading
+        
+        try:
+            return pickle.loads(zlib.decompress(payload))
+        except Exception:
+            return None
+    
+    # Store a value; returns False when it does not fit in a slot
+    def set(self, key, value, ttl=None):
+        payload = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), 1)
+        if len(payload) > self.slot_bytes - self.header.size:
+            return False
+        
+        buffer = self.mapping()
+        key_hash = self.key_hash(key)
+        offset = (key_hash % self.slots) * self.slot_bytes
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        
+        with self.write_lock, open(self.path + '.lock', 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # A writer that died mid-write leaves an odd sequence; round it up to even
+            sequence = self.header.unpack_from(buffer, offset)[0]
+            sequence += sequence % 2
+            
+            # Odd sequence marks the slot as being written
+            struct.pack_into('<Q', buffer, offset, sequence + 1)
+            start = offset + self.header.size
+            buffer[start:start + len(payload)] = payload
+            self.header.pack_into(buffer, offset, sequence + 1, key_hash, expires_at, len(payload), zlib.crc32(payload))
+            struct.pack_into('<Q', buffer, offset, sequence + 2)
+        return True
+    
+    # Drop a value if its slot still holds it
+    def delete(self, key):
+        buffer = self.mapping()
+        key_hash = self.key_hash(key)
+        offset = (key_hash % self.slots) * self.slot_bytes
+        
+        with self.write_lock, open(self.path + '.lock', 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            sequence, stored_hash = self.header.unpack_from(buffer, offset)[:2]
+            if stored_hash != key_hash:
+                return
+            sequence += sequence % 2
+            struct.pack_into('<Q', buffer, offset, sequence + 1)
+            self.header.pack_into(buffer, offset, sequence + 1, 0, 0.0, 0, 0)
+            struct.pack_into('<Q', buffer, offset, sequence + 2)
+
+result_cache = SharedResultCache(os.path.join(DATA_DIR, 'result_cache.mmap'))
+
+# Compact cache form of an analysis result: the ratio pack as MetricsRecord bytes and the
+# statements and sector/market rows as plain float arrays. Chart JSON and company info are
+# kept as they are; the dataframes are rebuilt by unpack_result when a result is served.
+def pack_result(ticker, result):
+    balance_sheet, income_stmt, cash_flow, metrics, chart_data, company_info = result
+    core = list(MetricsRecord.schema)
+    record = MetricsRecord.from_frame(ticker, metrics.loc[core].drop(columns='Industry Average').transpose())
+    extra = metrics.drop(index=core)
+    return {
+        'statements': [(statement.to_numpy(dtype=np.float64, na_value=np.nan), list(statement.index), list(statement.columns))
+                       for statement in (balance_sheet, income_stmt, cash_flow)],
+        'record': record.to_bytes(),
+        'extra': (extra.to_numpy(dtype=np.float64, na_value=np.nan), list(extra.index)),
+        'attrs': dict(metrics.attrs),
+        'charts': dict(chart_data),
+        'company_info': company_info,
+    }
+
+def unpack_result(ticker, payload):
+    balance_sheet, income_stmt, cash_flow = [pd.DataFrame(values, index=index, columns=columns)
+                                             for values, index, columns in payload['statements']]
+    display = MetricsRecord.from_bytes(ticker, payload['record']).to_display()
+    values, index = payload['extra']
+    metrics = pd.concat([display, pd.DataFrame(values, index=index, columns=display.columns)])
+    metrics.attrs.update(payload['attrs'])
+    return balance_sheet, income_stmt, cash_flow, metrics, payload['charts'], payload['company_info']
+
+# Function to calculate financial metrics through the shared result cache, so a result
+# computed by one worker is reused by every other worker on the host
+def cached_calculate_metrics(ticker, years_back=5, frequency='annual'):
+    key = ('metrics', ticker, years_back, frequency)
+    # A profiled request recomputes so there is something to measure
+    payload = None if profiling_requested() else result_cache.get(key)
+    if payload is not None:
+        return unpack_result(ticker, payload)
+    result = calculate_metrics(ticker, years_back, frequency)
+    if result[3] is not None:
+        result_cache.set(key, pack_result(ticker, result))
+    return result
+
+# Function to drop every cached analysis, export and scenario base of a ticker
+# (all year counts offered by the form)
+def invalidate_ticker(ticker):
+    with scenario_bases_lock:
+        for key in [key for key in scenario_bases if key[0] == ticker]:
+            del scenario_bases[key]
+    for years in range(1, 21):
+        for frequency in ('annual', 'quarterly'):
+            result_cache.delete(('metrics', ticker, years, frequency))
+            for format_type in export_formats:
+                result_cache.delete(('export', ticker, years, frequency, format_type))
+
+# Ratio alert thresholds as metric -> (operator, value); an alert is recorded when a new
+# or restated period moves a ratio across its threshold. Override with ALERT_THRESHOLDS,
+# e.g. '{"Debt Ratio": [">", 0.7]}'.
+alert_thresholds = {
+    'Current Ratio': ('<', 1.0),
+    'Quick Ratio': ('<', 0.5),
+    'Debt Ratio': ('>', 0.8),
+    'Profit Margin': ('<', 0.0),
+    'Return on Equity': ('<', 0.0)
+}
+alert_operators = ('>', '>=', '<', '<=')
+
+# Function to parse and validate the ALERT_THRESHOLDS override
+def parse_alert_thresholds(text):
+    thresholds = {}
+    for metric, rule in json.loads(text).items():
+        if metric not in metric_names:
+            raise ValueError(f"ALERT_THRESHOLDS: unknown metric {metric!r}")
+        if not isinstance(rule, (list, tuple)) or len(rule) != 2 or rule[0] not in alert_operators:
+            raise ValueError(f"ALERT_THRESHOLDS: {metric} needs [operator, value] with an operator in {', '.join(alert_operators)}")
+        thresholds[metric] = (rule[0], float(rule[1]))
+    return thresholds
+
+if os.environ.get('ALERT_THRESHOLDS'):
+    alert_thresholds = parse_alert_thresholds(os.environ['ALERT_THRESHOLDS'])
+
+# Seconds between background change checks (0 disables the background thread)
+change_check_interval = float(os.environ.get('CHANGE_CHECK_INTERVAL', 0))
+
+# Function to hash each fiscal column of a statement: the present line items and their
+# values, so a new period or a restated figure changes exactly that column's digest
+def fingerprint_statement(df):
+    df = df.sort_index()
+    names = np.array([str(name) for name in df.index], dtype=object)
+    values = df.to_numpy(dtype=np.float64)
+    digests = {}
+    for column, fiscal_date in enumerate(df.columns):
+        present = ~np.isnan(values[:, column])
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update('\x1f'.join(names[present]).encode())
+        digest.update(values[present, column].tobytes())
+        digests[str(fiscal_date)] = digest.hexdigest()
+    return digests
+
+# Change detection: keeps the fingerprints of every fetched fiscal column and the alerts
+# raised by changes, in the snapshot database. A check fetches a ticker's statements,
+# and only when a period is new or restated stores them, recomputes the ratios and
+# drops the ticker's cached results.
+class ChangeMonitor:
+    def __init__(self, path):
+        self.path = path
+        self.initialized = False
+        self.init_lock = threading.Lock()
+        self.thread = None
+    
+    def connect(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        if not self.initialized:
+            with self.init_lock:
+                connection.execute('PRAGMA journal_mode=WAL')
+                connection.execute('''
+                    CREATE TABLE IF NOT EXISTS statement_fingerprints (
+                        ticker TEXT NOT NULL,
+                        fiscal_date TEXT NOT NULL,
+                        statement TEXT NOT NULL,
+                        digest TEXT NOT NULL,
+                        checked_at TEXT NOT NULL,
+                        PRIMARY KEY (ticker, fiscal_date, statement)
+                    ) WITHOUT ROWID
+                ''')
+                connection.execute('''
+                    CREATE TABLE IF NOT EXISTS ratio_alerts (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        ticker TEXT NOT NULL,
+                        fiscal_date TEXT NOT NULL,
+                        metric TEXT NOT NULL,
+                        operator TEXT NOT NULL,
+                        threshold REAL NOT NULL,
+                        previous REAL,
+                        value REAL NOT NULL,
+                        reason TEXT NOT NULL,
+                        created_at TEXT NOT NULL
+                    )
+                ''')
+                connection.execute('CREATE INDEX IF NOT EXISTS ratio_alerts_ticker ON ratio_alerts (ticker, id)')
+                connection.commit()
+                self.initialized = True
+        return connection
+    
+    # Stored digests for a ticker: {(fiscal_date, statement): digest}
+    def fingerprints(self, ticker):
+        connection = self.connect()
+        try:
+            rows = connection.execute(
+                'SELECT fiscal_date, statement, digest FROM statement_fingerprints WHERE ticker = ?', (ticker,)).fetchall()
+        finally:
+            connection.close()
+        return {(fiscal_date, statement): digest for fiscal_date, statement, digest in rows}
+    
+    # Check one ticker; returns {'new': [...], 'restated': [...], 'alerts': [...]}
+    def check(self, ticker, years_back=5):
+        # Company info is only needed to recompute, so it is fetched once a change is found
+        balance_sheet, income_stmt, cash_flow = fetch_statements(ticker)
+        current = {}
+        for statement, df in zip(SnapshotStore.statements, (balance_sheet, income_stmt, cash_flow)):
+            for fiscal_date, digest in fingerprint_statement(df).items():
+                current[(fiscal_date, statement)] = digest
+        
+        stored = self.fingerprints(ticker)
+        stored_dates = {fiscal_date for fiscal_date, _ in stored}
+        changed = {fiscal_date for (fiscal_date, statement), digest in current.items() if stored.get((fiscal_date, statement)) != digest}
+        new_periods = sorted(changed - stored_dates, reverse=True)
+        restated = sorted(changed & stored_dates, reverse=True)
+        if not changed:
+            return {'ticker': ticker, 'new': [], 'restated': [], 'alerts': [], 'baseline': False}
+        
+        # Something changed: store the statements, recompute the ratios and drop stale results
+        previous = ratio_table.get(ticker)
+        company_info = upstream.get(ticker, 'info')
+        snapshot_store.record(ticker, balance_sheet, income_stmt, cash_flow)
+        history = snapshot_store.history(ticker)
+        error = update_ratio_record(ticker, company_info, *history, years_back=years_back)
+        if error:
+            raise ValueError(error)
+        score_store.record([ratio_table.get(ticker)])
+        invalidate_ticker(ticker)
+        
+        # The first check of a ticker only records a baseline
+        alerts = []
+        if stored:
+            alerts = self.evaluate(ticker, previous, ratio_table.get(ticker), new_periods, restated)
+        
+        checked_at = datetime.now().isoformat(timespec='seconds')
+        connection = self.connect()
+        try:
+            with connection:
+                connection.executemany('''
+                    INSERT INTO statement_fingerprints VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (ticker, fiscal_date, statement) DO UPDATE SET
+                        digest = excluded.digest, checked_at = excluded.checked_at
+                ''', [(ticker, fiscal_date, statement, digest, checked_at)
+                      for (fiscal_date, statement), digest in current.items()])
+                connection.executemany('''
+                    INSERT INTO ratio_alerts (ticker, fiscal_date, metric, operator, threshold, previous, value, reason, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', [(ticker, a['period'], a['metric'], a['operator'], a['threshold'], a['previous'], a['value'],
+                       a['reason'], checked_at) for a in alerts])
+        finally:
+            connection.close()
+        return {'ticker': ticker, 'new': new_periods, 'restated': restated, 'alerts': alerts, 'baseline': not stored}
+    
+    # Threshold crossings for the changed periods: a new period is compared with the period
+    # before it, a restated period with its previously computed value
+    def evaluate(self, ticker, previous, record, new_periods, restated):
+        metrics = [metric for metric in alert_thresholds if metric in MetricsRecord.schema]
+        if record is None or not metrics:
+            return []
+        columns = [MetricsRecord.schema.index(metric) for metric in metrics]
+        operators = np.array([alert_thresholds[metric][0] for metric in metrics])
+        thresholds = np.array([float(alert_thresholds[metric][1]) for metric in metrics])
+        
+        def breached(values):
+            return np.select([operators == '>', operators == '>=', operators == '<'],
+                             [values > thresholds, values >= thresholds, values < thresholds],
+                             values <= thresholds)
+        
+        order = np.argsort(record.periods)[::-1]  # newest first
+        periods = record.periods[order]
+        values = record.values[order][:, columns]
+        
+        alerts = []
+        for reason, dates in (('new period', new_periods), ('restated', restated)):
+            for fiscal_date in dates:
+                position = np.flatnonzero(periods == np.datetime64(fiscal_date, 'D'))
+                if not len(position):
+                    continue  # outside the years kept in the table
+                position = position[0]
+                if reason == 'restated' and previous is not None and np.datetime64(fiscal_date, 'D') in previous.periods:
+                    reference = previous.values[np.flatnonzero(previous.periods == np.datetime64(fiscal_date, 'D'))[0]][columns]
+                elif position + 1 < len(periods):
+                    reference = values[position + 1]
+                else:
+                    continue
+                
+                crossed = breached(values[position]) & ~breached(reference) & ~np.isnan(reference)
+                for i in np.flatnonzero(crossed):
+                    alerts.append({'ticker': ticker, 'period': fiscal_date, 'metric': metrics[i],
+                                   'operator': str(operators[i]), 'threshold': float(thresholds[i]),
+                                   'previous': float(reference[i]), 'value': float(values[position, i]),
+                                   'reason': reason})
+        return alerts
+    
+    # Check several tickers (every tracked ticker by default); returns (results, errors)
+    def check_all(self, tickers=None, years_back=5):
+        results, errors = [], {}
+        for ticker in (tickers or sorted(set(companies) | set(ratio_table.records))):
+            try:
+                results.append(self.check(ticker, years_back))
+            except Exception as e:
+                errors[ticker] = str(e)
+        return results, errors
+    
+    # Most recent alerts, optionally for one ticker
+    def alerts(self, ticker=None, limit=100):
+        query = 'SELECT id, ticker, fiscal_date, metric, operator, threshold, previous, value, reason, created_at FROM ratio_alerts'
+        params = []
+        if ticker:
+            query += ' WHERE ticker = ?'
+            params.append(ticker)
+        query += ' ORDER BY id DESC LIMIT ?'
+        params.append(int(limit))
+        connection = self.connect()
+        try:
+            rows = connection.execute(query, params).fetchall()
+        finally:
+            connection.close()
+        names = ('id', 'ticker', 'period', 'metric', 'operator', 'threshold', 'previous', 'value', 'reason', 'created_at')
+        return [dict(zip(names, row)) for row in rows]
+    
+    # Background loop; with several worker processes only the one holding the lock file runs it
+    def run_periodically(self, interval):
+        lock_file = open(self.path + '.monitor.lock', 'a')
+        if fcntl:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return
+        while True:
+            results, errors = self.check_all()
+            for ticker, error in errors.items():
+                print(f"Change check error for {ticker}: {error}")
+            time.sleep(interval)
+    
+    def start(self, interval):
+        if interval > 0 and self.thread is None:
+            self.thread = threading.Thread(target=self.run_periodically, args=(interval,), daemon=True)
+            self.thread.start()
+
+change_monitor = ChangeMonitor(os.path.join(DATA_DIR, 'snapshots.db'))
+
+# Start the background checks with the first request, so helper processes that
+# import this module (e.g. the chart renderers) never run them
+@app.before_request
+def start_change_monitor():
+    if change_monitor.thread is None:
+        change_monitor.start(change_check_interval)
 
 @app.route('/analyze', methods=['POST'])
 def analyze():
     ticker = request.form.get('company')
     years = int(request.form.get('years', 5))
+    frequency = request.form.get('frequency', 'annual')
     
     try:
-        balance_sheet, income_stmt, cash_flow, metrics, chart_data, company_info = calculate_metrics(ticker, years)
+        balance_sheet, income_stmt, cash_flow, metrics, chart_data, company_info = cached_calculate_metrics(ticker, years, frequency)
         
         if metrics is None:
             return jsonify({'error': chart_data})  # chart_data contains error message
         
         # Convert DataFrames to HTML with improved formatting
-        metrics_html = metrics.to_html(classes='data-table', float_format=lambda x: f'{x:.2f}')
+        metrics_html = metrics.to_html(classes='data-table', float_format=lambda x: f'{x:.2f}', na_rep='N/A')
         balance_sheet_html = balance_sheet.to_html(classes='data-table', float_format=lambda x: f'{x:,.0f}')
         income_stmt_html = income_stmt.to_html(classes='data-table', float_format=lambda x: f'{x:,.0f}')
         cash_flow_html = cash_flow.to_html(classes='data-table', float_format=lambda x: f'{x:,.0f}')
@@ -714,24 +3115,398 @@ def analyze():
             'income_stmt': income_stmt_html,
             'cash_flow': cash_flow_html,
             'charts': chart_data,
-            'company_info': company_info if company_info else {}
+            'company_info': company_info if company_info else {},
+            'diagnostics': metrics.attrs.get('diagnostics', {})
+        })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)})
+
+@app.route('/analyze/stream', methods=['POST'])
+def analyze_stream():
+    ticker = request.form.get('company')
+    years = int(request.form.get('years', 5))
+    frequency = request.form.get('frequency', 'annual')
+    
+    # Stream newline-delimited JSON events: company info first, then the metrics
+    # and statements, then each chart as soon as it has been serialized
+    def generate():
+        def event(**payload):
+            return json.dumps(payload, default=str) + '\n'
+        
+        try:
+            key = ('metrics', ticker, years, frequency)
+            cached = result_cache.get(key)
+            if cached is not None:
+                balance_sheet, income_stmt, cash_flow, metrics, chart_data, company_info = unpack_result(ticker, cached)
+                yield event(type='company_info', company_info=company_info if company_info else {})
+                chart_data = chart_data.items()
+            else:
+                # Send the company info before the statements are fetched
+                company_info = upstream.get(ticker, 'info')
+                yield event(type='company_info', company_info=company_info if company_info else {})
+                company_info, balance_sheet, income_stmt, cash_flow, options = fetch_for_analysis(
+                    ticker, years, frequency, company_info)
+                
+                balance_sheet, income_stmt, cash_flow, metrics, chart_data, company_info = analyze_statements(
+                    ticker, company_info, balance_sheet, income_stmt, cash_flow, stream=True, **options)
+            if metrics is None:
+                yield event(type='error', error=chart_data)  # chart_data contains error message
+                return
+            
+            yield event(type='metrics', metrics=metrics.to_html(classes='data-table', float_format=lambda x: f'{x:.2f}', na_rep='N/A'))
+            yield event(type='statements',
+                        balance_sheet=balance_sheet.to_html(classes='data-table', float_format=lambda x: f'{x:,.0f}'),
+                        income_stmt=income_stmt.to_html(classes='data-table', float_format=lambda x: f'{x:,.0f}'),
+                        cash_flow=cash_flow.to_html(classes='data-table', float_format=lambda x: f'{x:,.0f}'))
+            yield event(type='diagnostics', diagnostics=metrics.attrs.get('diagnostics', {}))
+            
+            charts = {}
+            for name, figure in chart_data:
+                charts[name] = figure
+                yield event(type='chart', name=name, figure=figure)
+            
+            # Share a freshly computed result with the other workers, as /analyze does
+            if cached is None:
+                result_cache.set(key, pack_result(ticker, (balance_sheet, income_stmt, cash_flow, metrics, charts, company_info)))
+            
+            yield event(type='done')
+        
+        except Exception as e:
+            yield event(type='error', error=str(e))
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/history', methods=['POST'])
+def history():
+    ticker = request.form.get('company')
+    start_year = request.form.get('start_year')
+    end_year = request.form.get('end_year')
+    
+    try:
+        start = f"{int(start_year)}-01-01" if start_year else None
+        end = f"{int(end_year)}-12-31" if end_year else None
+        balance_sheet, income_stmt, cash_flow, metrics, chart_data, company_info = calculate_history_metrics(ticker, start, end)
+        
+        if metrics is None:
+            return jsonify({'error': chart_data})  # chart_data contains error message
+        
+        return jsonify({
+            'periods': list(balance_sheet.columns),
+            'metrics': metrics.to_html(classes='data-table', float_format=lambda x: f'{x:.2f}', na_rep='N/A'),
+            'metrics_data': json.loads(metrics.to_json(orient='index')),
+            'charts': chart_data,
+            'diagnostics': metrics.attrs.get('diagnostics', {})
+        })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)})
+
+@app.route('/screen', methods=['POST'])
+def screen():
+    # Screening only reads the precomputed ratio table - no Yahoo calls, no recomputation
+    params = request.get_json(silent=True) or {}
+    
+    try:
+        filters = [(f['metric'], f.get('op', '>'), f['value']) for f in params.get('filters', [])]
+        results = ratio_table.query(
+            filters=filters,
+            sort_by=params.get('sort_by'),
+            descending=params.get('descending', True),
+            limit=params.get('limit', 50),
+            latest_only=params.get('latest_only', True)
+        )
+        return jsonify({'results': results, 'count': len(results), 'universe': len(ratio_table)})
+    
+    except (KeyError, ValueError, TypeError) as e:
+        return jsonify({'error': f'Invalid screening query: {e}'})
+
+@app.route('/scenarios', methods=['POST'])
+def scenarios():
+    # Body: {"company": "AAPL", "drivers": {"revenue": [-0.1, 0, 0.1], "inventory": [0.2]}, "period": optional,
+    #        "metrics": optional list of ratios, "offset"/"limit": optional slice of scenarios to return}
+    # Every scenario is summarized per ratio; values are returned for at most MAX_SCENARIO_VALUES of them
+    params = request.get_json(silent=True) or {}
+    ticker = params.get('company')
+    
+    try:
+        base = get_scenario_base(ticker, params.get('period'))
+        grid = build_scenario_grid(params.get('drivers', {}))
+        results = evaluate_scenarios(base, grid)
+        
+        names = params.get('metrics') or list(results)
+        unknown = [name for name in names if name not in results]
+        if unknown:
+            raise ValueError(f"Unknown metrics: {', '.join(unknown)}")
+        count = len(next(iter(results.values())))
+        offset = max(0, int(params.get('offset', 0)))
+        limit = max(1, min(int(params.get('limit', max_scenario_values)), max_scenario_values))
+        window = slice(offset, offset + limit)
+        
+        return jsonify({
+            'company': ticker,
+            'period': base['period'],
+            'count': count,
+            'offset': offset,
+            'returned': len(range(count)[window]),
+            'drivers': {d: grid[d][window].tolist() for d in grid},
+            'metrics': {name: json_values(results[name][window]) for name in names},
+            'summary': {name: scenario_summary(results[name]) for name in names},
+            'base': {name: json_values(values)[0] for name, values in evaluate_scenarios(base, {}).items()}
+        })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)})
+
+@app.route('/portfolio', methods=['POST'])
+def portfolio():
+    # Body: {"holdings": {"AAPL": 0.5, "MSFT": 0.3, "JPM": 0.2}, "years": 5}; weights are normalized
+    params = request.get_json(silent=True) or {}
+    years = int(params.get('years', 5))
+    
+    try:
+        tickers, weights = normalize_holdings(params.get('holdings') or {})
+        records = portfolio_records(tickers, years)
+        result = aggregate_portfolio(records, weights, years)
+        
+        schema = MetricsRecord.schema
+        return jsonify({
+            'holdings': [{'ticker': ticker, 'weight': float(weight)} for ticker, weight in zip(tickers, weights)],
+            'periods': result['years'],
+            'metrics': {name: json_values(result['aggregate'][:, m]) for m, name in enumerate(schema)},
+            'coverage': {name: json_values(result['coverage'][:, m]) for m, name in enumerate(schema)},
+            'contributions': {
+                ticker: {name: json_values(result['contributions'][i, :, m]) for m, name in enumerate(schema)}
+                for i, ticker in enumerate(tickers)
+            },
+            'industry_averages': industry_averages,
+            'charts': portfolio_charts(tickers, weights, records, result)
         })
     
     except Exception as e:
         return jsonify({'error': str(e)})
 
+@app.route('/screen/refresh', methods=['POST'])
+def screen_refresh():
+    # Rebuilding the table fetches every ticker, so run it in the background
+    params = request.get_json(silent=True) or {}
+    tickers = params.get('tickers')
+    years = int(params.get('years', 5))
+    threading.Thread(target=refresh_ratio_table, args=(tickers, years), daemon=True).start()
+    return jsonify({'status': 'started', 'tickers': tickers or list(companies.keys())}), 202
+
+@app.route('/changes/check', methods=['POST'])
+def changes_check():
+    # Checking refetches every ticker, so run it in the background
+    params = request.get_json(silent=True) or {}
+    tickers = params.get('tickers')
+    years = int(params.get('years', 5))
+    threading.Thread(target=change_monitor.check_all, args=(tickers, years), daemon=True).start()
+    return jsonify({'status': 'started', 'tickers': tickers or sorted(set(companies) | set(ratio_table.records))}), 202
+
+@app.route('/scores/rankings')
+def scores_rankings():
+    try:
+        category = request.args.get('category', 'Overall')
+        return jsonify({'category': category,
+                        'rankings': score_store.rankings(category, request.args.get('limit', 50),
+                                                         request.args.get('order', 'desc') != 'asc')})
+    except Exception as e:
+        return jsonify({'error': str(e)})
+
+@app.route('/scores/<ticker>')
+def scores_history(ticker):
+    try:
+        return jsonify({'ticker': ticker.upper(), 'scores': score_store.history(ticker.upper())})
+    except Exception as e:
+        return jsonify({'error': str(e)})
+
+@app.route('/scores/refresh', methods=['POST'])
+def scores_refresh():
+    # Rescoring reads only the in-memory ratio table, so it runs inline
+    try:
+        return jsonify({'status': 'ok', 'rows': score_store.refresh()})
+    except Exception as e:
+        return jsonify({'error': str(e)})
+
+@app.route('/changes/alerts')
+def changes_alerts():
+    try:
+        return jsonify({'thresholds': alert_thresholds,
+                        'alerts': change_monitor.alerts(request.args.get('ticker'), request.args.get('limit', 100))})
+    except Exception as e:
+        return jsonify({'error': str(e)})
+
+# Charts embedded in the Word report
+report_chart_titles = {
+    'radar': 'Financial Performance Overview',
+    'liquidity': 'Liquidity Ratios',
+    'efficiency': 'Asset Turnover Ratios',
+    'dso': 'Days Sales Outstanding',
+    'profitability': 'Profitability Ratios',
+    'solvency': 'Debt Ratio'
+}
+
+# Metrics and colors plotted on each report chart (matching the Plotly charts)
+report_chart_series = {
+    'liquidity': [('Current Ratio', '#1f77b4'), ('Quick Ratio', '#ff7f0e')],
+    'efficiency': [('Current Asset Turnover', '#2ca02c'), ('Total Asset Turnover', '#d62728')],
+    'dso': [('Days Sales Outstanding', '#17becf')],
+    'profitability': [('Profit Margin', '#9467bd'), ('Return on Equity', '#8c564b'), ('Basic Earning Power', '#e377c2')],
+    'solvency': [('Debt Ratio', '#7f7f7f')]
+}
+
+# Number of processes rendering report chart images
+chart_render_workers = int(os.environ.get('CHART_RENDER_WORKERS', min(4, os.cpu_count() or 1)))
+
+# Function to render one report chart as PNG bytes with matplotlib
+# periods are ordered newest first; series maps metric name -> values (or 'scores' for the radar)
+# for the ratios to plot
+def render_chart_image(name, periods, series, averages, period_label='Year', ticker=''):
+    fig = Figure(figsize=(8, 4.5), dpi=150)
+    
+    if name == 'radar':
+        categories = ['Liquidity', 'Efficiency', 'Profitability', 'Solvency']
+        angles = np.linspace(0, 2 * np.pi, len(categories), endpoint=False).tolist()
+        ax = fig.add_subplot(polar=True)
+        for values, label, color, style in ((series['scores'], ticker, '#1f77b4', '-'),
+                                            ([1] * len(categories), 'Industry Average', '#ff7f0e', '--')):
+            closed = list(values) + [values[0]]
+            ax.plot(angles + angles[:1], closed, color=color, linestyle=style, linewidth=2, label=label)
+            ax.fill(angles + angles[:1], closed, color=color, alpha=0.2 if style == '-' else 0.05)
+        ax.set_xticks(angles)
+        ax.set_xticklabels(categories)
+        ax.set_ylim(0, 2)
+        ax.set_yticks([0.5, 1, 1.5, 2])
+        ax.set_rlabel_position(22.5)
+        ax.legend(loc='upper right', bbox_to_anchor=(1.3, 1.1))
+    else:
+        ax = fig.add_subplot()
+        x = np.arange(len(periods))
+        labels = list(reversed(periods))  # Oldest first, left to right
+        entries = [(metric, color) for metric, color in report_chart_series[name] if metric in series]
+        bar_chart = name in ('profitability', 'solvency')
+        width = 0.8 / len(entries)
+        
+        for i, (metric, color) in enumerate(entries):
+            values = list(reversed(series[metric]))
+            if bar_chart:
+                ax.bar(x + (i - (len(entries) - 1) / 2) * width, values, width, color=color, label=metric)
+            else:
+                ax.plot(x, values, marker='o', linewidth=2.5, color=color, label=metric)
+            ax.axhline(averages[metric], color='red' if name == 'solvency' else color,
+                       linestyle='--', linewidth=1, label=f'{metric} Ind. Avg')
+        
+        ax.set_xticks(x)
+        ax.set_xticklabels(labels, rotation=30 if len(labels) > 6 else 0)
+        ax.set_xlabel(period_label)
+        ax.set_ylabel('Days' if name == 'dso' else 'Ratio Value')
+        ax.grid(axis='y', alpha=0.3)
+        ax.legend(fontsize=8, ncol=2)
+    
+    ax.set_title(report_chart_titles[name], fontsize=14)
+    
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', bbox_inches='tight')
+    return buffer.getvalue()
+
+chart_pool = None
+chart_pool_lock = threading.Lock()
+
+# Helper function to get the (lazily started) chart rendering process pool
+def get_chart_pool():
+    global chart_pool
+    with chart_pool_lock:
+        if chart_pool is None:
+            chart_pool = ProcessPoolExecutor(max_workers=chart_render_workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        return chart_pool
+
+# Function to start rendering the report charts for a metrics display dataframe
+# Returns name -> Future of PNG bytes; images are cached by a hash of the plotted data
+def submit_chart_images(ticker, metrics, period_label='Year'):
+    periods = [column for column in metrics.columns if column != 'Industry Average']
+    images = {}
+    
+    for name in report_chart_titles:
+        if name == 'radar':
+            series = {'scores': [float(v) for v in radar_scores(metrics[periods[0]])]}
+            averages = {}
+        else:
+            # Leave out ratios that are N/A in every period (e.g. liquidity for banks)
+            # and the whole chart when none of its ratios is reported
+            series = {metric: [float(v) for v in metrics.loc[metric, periods].fillna(0)]
+                      for metric, color in report_chart_series[name] if metrics.loc[metric, periods].notna().any()}
+            averages = {metric: industry_averages[metric] for metric in series}
+            if not series or (name == 'dso' and not any(series['Days Sales Outstanding'])):
+                continue
+        
+        args = (name, periods, series, averages, period_label, ticker)
+        key = ('chart_image', hashlib.sha1(json.dumps(args, sort_keys=True).encode()).hexdigest())
+        cached = result_cache.get(key)
+        if cached is not None:
+            images[name] = Future()
+            images[name].set_result(cached)
+            continue
+        
+        try:
+            images[name] = get_chart_pool().submit(render_chart_image, *args)
+        except Exception as pool_error:
+            # Render in-process if the pool cannot be used
+            print(f"Chart pool error: {pool_error}")
+            images[name] = Future()
+            images[name].set_result(render_chart_image(*args))
+        images[name].add_done_callback(
+            lambda future, key=key: result_cache.set(key, future.result()) if future.exception() is None else None)
+    
+    return images
+
+# Helper function to add a rendered chart to a Word document (skipped if rendering failed)
+def add_chart_image(doc, images, name):
+    if name not in images:
+        return
+    try:
+        doc.add_picture(io.BytesIO(images[name].result(timeout=60)), width=Inches(6))
+        doc.paragraphs[-1].alignment = WD_ALIGN_PARAGRAPH.CENTER
+    except Exception as image_error:
+        print(f"Chart image error ({name}): {image_error}")
+
+# Mimetype and file name for each export format
+export_formats = {
+    'excel': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', '{ticker}_financial_metrics.xlsx'),
+    'word': ('application/vnd.openxmlformats-officedocument.wordprocessingml.document', '{ticker}_financial_analysis.docx')
+}
+
 @app.route('/download', methods=['POST'])
 def download():
     ticker = request.form.get('company')
     years = int(request.form.get('years', 5))
     format_type = request.form.get('format', 'excel')  # Default to Excel, but allow Word
+    frequency = request.form.get('frequency', 'annual')
     
     try:
-        balance_sheet, income_stmt, cash_flow, metrics, chart_data, company_info = calculate_metrics(ticker, years)
+        # Serve a previously generated export from the shared cache
+        export_key = ('export', ticker, years, frequency, format_type)
+        if format_type in export_formats and not profiling_requested():
+            cached_export = result_cache.get(export_key)
+            if cached_export is not None:
+                mimetype, filename = export_formats[format_type]
+                return send_file(io.BytesIO(cached_export), mimetype=mimetype, as_attachment=True,
+                                 download_name=filename.format(ticker=ticker))
+        
+        # Profile the export build (including any metrics computation) when requested
+        begin_profile(ticker, f'{format_type} export')
+        
+        balance_sheet, income_stmt, cash_flow, metrics, chart_data, company_info = cached_calculate_metrics(ticker, years, frequency)
         
         if metrics is None:
             return jsonify({'error': 'Failed to calculate metrics: ' + chart_data})
         
+        # Sector ratios from the metric pack the analysis used
+        pack = metric_packs[metrics.attrs.get('diagnostics', {}).get('metric_pack', 'General')]
+        sector_formulas = pack['formulas']
+        
         if format_type == 'excel':
             # Create Excel file
             output = io.BytesIO()
@@ -751,10 +3526,21 @@ def download():
                     ["Profit Margin", "Net Income / Revenue"],
                     ["Debt Ratio", "Total Liabilities / Total Assets"],
                     ["Return on Equity", "Net Income / Shareholders' Equity"],
-                    ["Basic Earning Power", "EBIT / Total Assets"]
-                ], columns=["Metric", "Formula"])
+                    ["Basic Earning Power", "EBIT / Total Assets"],
+                    ["P/E Ratio", "Price / (Net Income / Shares Outstanding)"],
+                    ["EV/EBITDA", "(Market Cap + Total Debt - Cash) / EBITDA"],
+                    ["Dividend Yield", "Trailing 12-Month Dividends / Price"],
+                    ["Volatility (1Y)", "Standard Deviation of Daily Log Returns (252 days) * sqrt(252)"],
+                    ["Max Drawdown (1Y)", "Largest Peak-to-Trough Decline over 252 Trading Days"]
+                ] + [[name, formula] for name, formula in sector_formulas.items()], columns=["Metric", "Formula"])
                 formulas.to_excel(writer, sheet_name='Formulas', index=False)
+                
+                # Add data-quality sheets: gaps and zero-fills per period, and where each line item came from
+                quality_periods, quality_sources = diagnostics_tables(metrics.attrs.get('diagnostics', {}))
+                quality_periods.to_excel(writer, sheet_name='Data Quality', index=False)
+                quality_sources.to_excel(writer, sheet_name='Line Item Sources', index=False)
             
+            result_cache.set(export_key, output.getvalue())
             output.seek(0)
             
             return send_file(
@@ -765,6 +3551,9 @@ def download():
             )
         
         elif format_type == 'word':
+            # Start rendering the chart images while the text is being written
+            images = submit_chart_images(ticker, metrics, 'Quarter (TTM)' if frequency == 'quarterly' else 'Year')
+            
             # Create Word document with specified structure
             doc = Document()
             
@@ -820,15 +3609,21 @@ def download():
                 normal_style = 'Normal'
                 table_header = 'Strong'
             
+            # Company name from the registry, falling back to Yahoo's name or the symbol itself
+            company_name = (company_registry.name(ticker)
+                            or (company_info or {}).get('longName')
+                            or (company_info or {}).get('shortName')
+                            or ticker)
+            
             # Title page (use style names as strings in case we're using fallback)
-            title = doc.add_paragraph(f"Financial Analysis Report: {companies[ticker]}", style=title_style)
+            title = doc.add_paragraph(f"Financial Analysis Report: {company_name}", style=title_style)
             doc.add_paragraph(f"Symbol: {ticker}", style=normal_style)
             doc.add_paragraph(f"Report Generated: {datetime.now().strftime('%B %d, %Y')}", style=normal_style)
             
             # Abstract
             doc.add_heading("Abstract", level=1)
             doc.add_paragraph("This report provides a comprehensive financial analysis of " + 
-                             f"{companies[ticker]} based on data retrieved from Yahoo Finance. " +
+                             f"{company_name} based on data retrieved from Yahoo Finance. " +
                              "The analysis includes key financial ratios, trend analysis, and policy recommendations.", 
                              style=normal_style)
             
@@ -836,10 +3631,11 @@ def download():
             doc.add_heading("Introduction", level=1)
             
             # Add company description if available
-            if ticker in company_descriptions:
-                doc.add_paragraph(company_descriptions[ticker], style=normal_style)
+            description = company_registry.description(ticker) or (company_info or {}).get('longBusinessSummary')
+            if description:
+                doc.add_paragraph(description, style=normal_style)
             else:
-                doc.add_paragraph(f"{companies[ticker]} is a publicly traded company with the ticker symbol {ticker}.", 
+                doc.add_paragraph(f"{company_name} is a publicly traded company with the ticker symbol {ticker}.", 
                                  style=normal_style)
             
             # Add industry context
@@ -849,53 +3645,61 @@ def download():
             
             # Financial Ratios Section
             doc.add_heading("Financial Ratios Analysis", level=1)
+            add_chart_image(doc, images, 'radar')
             
             # 1. Liquidity Ratios
             doc.add_heading("Liquidity Ratios", level=2)
             doc.add_paragraph("Liquidity ratios measure the company's ability to meet short-term obligations.", style=normal_style)
+            add_chart_image(doc, images, 'liquidity')
             
             # Get most recent data
-            recent_year = metrics.index[0]
+            recent_year = metrics.columns[0]
             
             # Current Ratio
             current_ratio = metrics.loc['Current Ratio', recent_year]
             industry_cr = metrics.loc['Current Ratio', 'Industry Average']
             cr_analysis = "above" if current_ratio > industry_cr else "below"
             
-            doc.add_paragraph(f"Current Ratio: {current_ratio:.2f}", style=normal_style)
-            doc.add_paragraph(f"The current ratio of {current_ratio:.2f} is {cr_analysis} the industry average of {industry_cr:.2f}. " +
-                            ("This indicates strong short-term liquidity position." if current_ratio > industry_cr else 
-                             "This may indicate potential challenges in meeting short-term obligations."), 
-                             style=normal_style)
-            
             # Quick Ratio
             quick_ratio = metrics.loc['Quick Ratio', recent_year]
             industry_qr = metrics.loc['Quick Ratio', 'Industry Average']
             qr_analysis = "above" if quick_ratio > industry_qr else "below"
             
-            doc.add_paragraph(f"Quick Ratio: {quick_ratio:.2f}", style=normal_style)
-            doc.add_paragraph(f"The quick ratio of {quick_ratio:.2f} is {qr_analysis} the industry average of {industry_qr:.2f}. " +
-                            ("This indicates strong ability to meet short-term obligations without relying on inventory sales." 
-                             if quick_ratio > industry_qr else 
-                             "This may indicate potential challenges in meeting immediate short-term obligations without selling inventory."), 
-                             style=normal_style)
+            if pd.isna(current_ratio):
+                doc.add_paragraph("The balance sheet does not separate current assets and liabilities, so liquidity "
+                                  "ratios do not apply; see the sector metrics below.", style=normal_style)
+            else:
+                doc.add_paragraph(f"Current Ratio: {current_ratio:.2f}", style=normal_style)
+                doc.add_paragraph(f"The current ratio of {current_ratio:.2f} is {cr_analysis} the industry average of {industry_cr:.2f}. " +
+                                ("This indicates strong short-term liquidity position." if current_ratio > industry_cr else 
+                                 "This may indicate potential challenges in meeting short-term obligations."), 
+                                 style=normal_style)
+            
+                doc.add_paragraph(f"Quick Ratio: {quick_ratio:.2f}", style=normal_style)
+                doc.add_paragraph(f"The quick ratio of {quick_ratio:.2f} is {qr_analysis} the industry average of {industry_qr:.2f}. " +
+                                ("This indicates strong ability to meet short-term obligations without relying on inventory sales." 
+                                 if quick_ratio > industry_qr else 
+                                 "This may indicate potential challenges in meeting immediate short-term obligations without selling inventory."), 
+                                 style=normal_style)
             
             # 2. Efficiency Ratios
             doc.add_heading("Efficiency Ratios", level=2)
             doc.add_paragraph("Efficiency ratios measure how effectively the company uses its assets and manages its operations.", 
                             style=normal_style)
+            add_chart_image(doc, images, 'efficiency')
             
             # Asset Turnover Ratios
             cat = metrics.loc['Current Asset Turnover', recent_year]
             industry_cat = metrics.loc['Current Asset Turnover', 'Industry Average']
             cat_analysis = "above" if cat > industry_cat else "below"
             
-            doc.add_paragraph(f"Current Asset Turnover: {cat:.2f}", style=normal_style)
-            doc.add_paragraph(f"The current asset turnover ratio of {cat:.2f} is {cat_analysis} the industry average of {industry_cat:.2f}. " +
-                            ("This indicates efficient use of current assets in generating revenue." 
-                             if cat > industry_cat else 
-                             "This may indicate room for improvement in utilizing current assets to generate revenue."), 
-                             style=normal_style)
+            if not pd.isna(cat):
+                doc.add_paragraph(f"Current Asset Turnover: {cat:.2f}", style=normal_style)
+                doc.add_paragraph(f"The current asset turnover ratio of {cat:.2f} is {cat_analysis} the industry average of {industry_cat:.2f}. " +
+                                ("This indicates efficient use of current assets in generating revenue." 
+                                 if cat > industry_cat else 
+                                 "This may indicate room for improvement in utilizing current assets to generate revenue."), 
+                                 style=normal_style)
             
             tat = metrics.loc['Total Asset Turnover', recent_year]
             industry_tat = metrics.loc['Total Asset Turnover', 'Industry Average']
@@ -920,11 +3724,13 @@ def download():
                                  if dso < industry_dso else 
                                  "This may indicate room for improvement in receivables collection practices."), 
                                  style=normal_style)
+                add_chart_image(doc, images, 'dso')
             
             # 3. Profitability Ratios
             doc.add_heading("Profitability Ratios", level=2)
             doc.add_paragraph("Profitability ratios measure the company's ability to generate profits relative to revenue, assets, and equity.", 
                             style=normal_style)
+            add_chart_image(doc, images, 'profitability')
             
             # Profit Margin
             pm = metrics.loc['Profit Margin', recent_year]
@@ -966,6 +3772,7 @@ def download():
             doc.add_heading("Solvency Ratios", level=2)
             doc.add_paragraph("Solvency ratios measure the company's ability to meet long-term obligations.", 
                             style=normal_style)
+            add_chart_image(doc, images, 'solvency')
             
             # Debt Ratio
             dr = metrics.loc['Debt Ratio', recent_year]
@@ -979,6 +3786,47 @@ def download():
                              "This indicates higher leverage, which may increase financial risk but also potential returns."), 
                              style=normal_style)
             
+            # 5. Market Metrics (only when price history was available)
+            market_rows = [name for name in market_metric_names
+                           if name in metrics.index and not pd.isna(metrics.loc[name, recent_year])]
+            if market_rows:
+                doc.add_heading("Market Metrics", level=2)
+                doc.add_paragraph("Market metrics relate the company's fundamentals to its share price and trading history.", 
+                                style=normal_style)
+                for name in market_rows:
+                    value = metrics.loc[name, recent_year]
+                    if name in ('Dividend Yield', 'Volatility (1Y)', 'Max Drawdown (1Y)'):
+                        doc.add_paragraph(f"{name}: {value:.2%}", style=normal_style)
+                    else:
+                        doc.add_paragraph(f"{name}: {value:.2f}", style=normal_style)
+            
+            # 6. Sector metrics from the metric pack (e.g. banking)
+            sector_rows = [name for name in pack['metrics']
+                           if name in metrics.index and not pd.isna(metrics.loc[name, recent_year])]
+            if sector_rows:
+                pack_name = metrics.attrs['diagnostics']['metric_pack']
+                doc.add_heading(f"{pack_name} Sector Metrics", level=2)
+                doc.add_paragraph(f"These ratios are specific to the {pack_name.lower()} sector and are compared with sector benchmarks.", 
+                                style=normal_style)
+                for name in sector_rows:
+                    value = metrics.loc[name, recent_year]
+                    benchmark = pack['benchmarks'][name]
+                    doc.add_paragraph(f"{name}: {value:.2%} (benchmark {benchmark:.2%}; {pack['formulas'][name]})", 
+                                    style=normal_style)
+            
+            # 7. Data quality notes (only when something had to be approximated)
+            diagnostics = metrics.attrs.get('diagnostics', {})
+            imputed_periods = [entry for entry in diagnostics.get('periods', []) if entry['imputed_metrics']]
+            if diagnostics.get('fallbacks') or imputed_periods:
+                doc.add_heading("Data Quality Notes", level=2)
+                doc.add_paragraph("Some reported line items were unavailable, so the following approximations apply:", 
+                                style=normal_style)
+                for fallback in diagnostics.get('fallbacks', []):
+                    doc.add_paragraph(f"• {fallback}.", style=normal_style)
+                for entry in imputed_periods:
+                    doc.add_paragraph(f"• {entry['period']}: {', '.join(entry['imputed_metrics'])} shown as 0 "
+                                      "(inputs missing).", style=normal_style)
+            
             # Conclusion
             doc.add_heading("Conclusion", level=1)
             
@@ -986,8 +3834,9 @@ def download():
             strengths = []
             weaknesses = []
             
-            # Assess liquidity
-            if current_ratio > industry_cr: strengths.append("strong liquidity position")
+            # Assess liquidity (when the sector reports current items)
+            if pd.isna(current_ratio): pass
+            elif current_ratio > industry_cr: strengths.append("strong liquidity position")
             else: weaknesses.append("potential liquidity challenges")
             
             # Assess efficiency
@@ -1002,7 +3851,7 @@ def download():
             if dr < industry_dr: strengths.append("conservative debt management")
             else: weaknesses.append("higher than average leverage")
             
-            conclusion_text = f"Based on the financial analysis, {companies[ticker]} demonstrates "
+            conclusion_text = f"Based on the financial analysis, {company_name} demonstrates "
             
             if strengths:
                 conclusion_text += "strengths in " + ", ".join(strengths)
@@ -1046,7 +3895,7 @@ def download():
                 doc.add_paragraph("• Consider divesting underperforming assets or improving their productivity.", style=normal_style)
             
             # If DSO is high
-            if 'Days Sales Outstanding' in metrics.index and metrics.loc['Days Sales Outstanding', recent_year] > industry_dso:
+            if 'Days Sales Outstanding' in metrics.index and metrics.loc['Days Sales Outstanding', recent_year] > metrics.loc['Days Sales Outstanding', 'Industry Average']:
                 doc.add_paragraph("Accounts Receivable Management:", style=heading_style)
                 doc.add_paragraph("• Implement more efficient credit and collection policies to reduce days sales outstanding.", style=normal_style)
                 doc.add_paragraph("• Consider early payment incentives or stricter credit terms.", style=normal_style)
@@ -1074,6 +3923,7 @@ def download():
             
             try:
                 doc.save(output)
+                result_cache.set(export_key, output.getvalue())
                 output.seek(0)
                 
                 return send_file(
@@ -1091,6 +3941,155 @@ def download():
     except Exception as e:
         return jsonify({'error': str(e)})
 
+@app.route('/admin/profiles')
+def admin_profiles():
+    if not admin_authorized():
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify({'sample_rate': profile_sample_rate, 'keep': profile_keep, 'profiles': profile_store.summaries()})
+
+# Download one capture: the text report, or format=prof for the raw cProfile stats
+# (load with pstats.Stats or snakeviz)
+@app.route('/admin/profiles/<int:profile_id>')
+def admin_profile(profile_id):
+    if not admin_authorized():
+        return jsonify({'error': 'Forbidden'}), 403
+    entry = profile_store.get(profile_id)
+    if entry is None:
+        return jsonify({'error': f'Unknown profile: {profile_id}'}), 404
+    
+    name = f"{entry['ticker']}_{entry['operation'].replace(' ', '_')}_{profile_id}"
+    if request.args.get('format') == 'prof':
+        if not entry['stats']:
+            return jsonify({'error': 'No cProfile data was captured for this profile'}), 404
+        return send_file(io.BytesIO(entry['stats']), mimetype='application/octet-stream',
+                         as_attachment=True, download_name=name + '.prof')
+    return send_file(io.BytesIO(entry['report'].encode()), mimetype='text/plain',
+                     as_attachment=True, download_name=name + '.txt')
+
+# Function to read a ticker list: one or more symbols per line, separated by commas or
+# whitespace; blank lines and '#' comments are ignored and duplicates are dropped
+def read_ticker_list(lines):
+    tickers = []
+    for line in lines:
+        for symbol in re.split(r'[\s,]+', line.split('#', 1)[0]):
+            symbol = symbol.strip().upper()
+            if symbol and symbol not in tickers:
+                tickers.append(symbol)
+    return tickers
+
+# Function to flatten one ticker's metrics table into rows (one per period) for batch output
+def metrics_rows(ticker, metrics):
+    table = metrics.drop(columns='Industry Average', errors='ignore').transpose()
+    rows = []
+    for period, values in table.iterrows():
+        row = {'Ticker': ticker, 'Period': str(period)}
+        row.update({name: (None if pd.isna(value) else float(value)) for name, value in values.items()})
+        rows.append(row)
+    return rows
+
+# Function to compute one ticker for the batch runner; returns (rows, None) or (None, error)
+def batch_metrics(ticker, years_back, frequency):
+    try:
+        # No charts, and the ratio table is saved once at the end of the run
+        company_info, balance_sheet, income_stmt, cash_flow, options = fetch_for_analysis(ticker, years_back, frequency)
+        balance_sheet, income_stmt, cash_flow, metrics, chart_data, company_info = analyze_statements(
+            ticker, company_info, balance_sheet, income_stmt, cash_flow, charts=False, save_table=False, **options)
+        if metrics is None:
+            return None, chart_data  # chart_data contains error message
+        return metrics_rows(ticker, metrics), None
+    except Exception as e:
+        return None, str(e)
+
+# Headless batch runner: flask --app app batch tickers.txt -o metrics.parquet
+# Completed tickers are appended to a JSON-lines checkpoint as they finish, so an
+# interrupted run picks up where it stopped; failed tickers are retried on resume.
+@app.cli.command('batch', help='Compute metrics for a list of tickers and write them to one Parquet or CSV file.')
+@click.argument('ticker_file', type=click.File('r'))
+@click.option('--output', '-o', default='metrics.csv', show_default=True,
+              help='Consolidated output file; .parquet or .csv')
+@click.option('--years', default=5, show_default=True, help='Years (or quarters) of history per ticker')
+@click.option('--frequency', type=click.Choice(['annual', 'quarterly']), default='annual', show_default=True)
+@click.option('--workers', default=4, show_default=True, help='Tickers fetched in parallel')
+@click.option('--checkpoint', default=None, help='Checkpoint file (defaults to <output>.checkpoint)')
+def batch_command(ticker_file, output, years, frequency, workers, checkpoint):
+    if not output.lower().endswith(('.parquet', '.csv')):
+        raise click.BadParameter('output must end in .parquet or .csv', param_hint='--output')
+    if output.lower().endswith('.parquet'):
+        # Fail before fetching anything if no Parquet engine is installed
+        try:
+            pd.io.parquet.get_engine('auto')
+        except ImportError:
+            raise click.ClickException('Parquet output needs pyarrow or fastparquet installed; use a .csv output instead')
+    checkpoint = checkpoint or output + '.checkpoint'
+    tickers = read_ticker_list(ticker_file)
+    
+    # Resume: keep the rows of tickers already completed by an earlier run
+    completed = {}
+    if os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by an interrupted run
+                if entry.get('rows') is not None:
+                    completed[entry['ticker']] = entry['rows']
+    pending = [ticker for ticker in tickers if ticker not in completed]
+    click.echo(f"{len(tickers)} tickers, {len(tickers) - len(pending)} already completed, {len(pending)} to fetch")
+    
+    errors = {}
+    start = time.perf_counter()
+    with open(checkpoint, 'a') as log, ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(batch_metrics, ticker, years, frequency): ticker for ticker in pending}
+        for done, future in enumerate(as_completed(futures), 1):
+            ticker = futures[future]
+            rows, error = future.result()
+            if rows is None:
+                errors[ticker] = error
+            else:
+                completed[ticker] = rows
+            log.write(json.dumps({'ticker': ticker, 'rows': rows, 'error': error}) + '\n')
+            log.flush()
+            click.echo(f"[{done}/{len(pending)}] {ticker}: {'ok' if error is None else 'error'}")
+    elapsed = time.perf_counter() - start
+    
+    # Write the consolidated table in ticker-list order
+    results = pd.DataFrame([row for ticker in tickers for row in completed.get(ticker, [])])
+    if output.lower().endswith('.parquet'):
+        results.to_parquet(output, index=False)
+    else:
+        results.to_csv(output, index=False)
+    ratio_table.save()
+    
+    # Throughput and error summary
+    click.echo(f"Fetched {len(pending) - len(errors)}/{len(pending)} tickers in {elapsed:.1f}s "
+               f"({len(pending) / elapsed if elapsed else 0:.2f} tickers/s, {workers} workers)")
+    click.echo(f"Wrote {len(results)} rows for {len(tickers) - len(errors)} tickers to {output}")
+    if errors:
+        click.echo(f"{len(errors)} failed (retried on the next run):")
+        for ticker, error in errors.items():
+            click.echo(f"  {ticker}: {error}")
+
+# Run one change check from cron: flask --app app check-changes [TICKER ...]
+@app.cli.command('check-changes', help='Fingerprint statements and recompute tickers with new or restated periods.')
+@click.argument('tickers', nargs=-1)
+@click.option('--years', default=5, show_default=True, help='Years of history kept in the ratio table')
+def check_changes_command(tickers, years):
+    results, errors = change_monitor.check_all([ticker.upper() for ticker in tickers] or None, years)
+    for result in results:
+        if result['baseline']:
+            click.echo(f"{result['ticker']}: baseline recorded for {len(result['new'])} periods")
+        elif result['new'] or result['restated']:
+            click.echo(f"{result['ticker']}: new {result['new']}, restated {result['restated']}, "
+                       f"{len(result['alerts'])} alerts")
+        for alert in result['alerts']:
+            click.echo(f"  ALERT {alert['metric']} {alert['operator']} {alert['threshold']} for {alert['period']} "
+                       f"({alert['previous']:.3f} -> {alert['value']:.3f}, {alert['reason']})")
+    unchanged = sum(1 for result in results if not result['new'] and not result['restated'])
+    click.echo(f"{len(results)} checked, {unchanged} unchanged, {len(errors)} failed")
+    for ticker, error in errors.items():
+        click.echo(f"  {ticker}: {error}")
+
 if __name__ == '__main__':
    port = int(os.environ.get('PORT', 5000))
    app.run(host='0.0.0.0', port=port)
\ No newline at end of file
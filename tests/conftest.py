@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# Keep the module-level stores out of the repository's data directory
+os.environ.setdefault('DATA_DIR', tempfile.mkdtemp(prefix='ratio-app-tests-'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
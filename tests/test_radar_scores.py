@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from app import industry_averages, metric_names, metric_packs, radar_score_matrix, radar_scores
+
+
+# The scalar scoring radar_score_matrix replaced, kept as the reference
+def scalar_radar_scores(recent):
+    current_ratio_norm = min(recent['Current Ratio'] / industry_averages['Current Ratio'], 2)
+    quick_ratio_norm = min(recent['Quick Ratio'] / industry_averages['Quick Ratio'], 2)
+
+    current_asset_turnover_norm = recent['Current Asset Turnover'] / industry_averages['Current Asset Turnover']
+    total_asset_turnover_norm = recent['Total Asset Turnover'] / industry_averages['Total Asset Turnover']
+
+    if recent['Days Sales Outstanding'] > 0:
+        dso_norm = industry_averages['Days Sales Outstanding'] / max(recent['Days Sales Outstanding'], 1)
+    else:
+        dso_norm = 1
+
+    profit_margin_norm = recent['Profit Margin'] / max(industry_averages['Profit Margin'], 0.01)
+    roe_norm = recent['Return on Equity'] / max(industry_averages['Return on Equity'], 0.01)
+    bep_norm = recent['Basic Earning Power'] / max(industry_averages['Basic Earning Power'], 0.01)
+
+    debt_ratio_norm = 2 - (recent['Debt Ratio'] / industry_averages['Debt Ratio'])
+
+    return [
+        (current_ratio_norm + quick_ratio_norm) / 2,
+        (current_asset_turnover_norm + total_asset_turnover_norm + dso_norm) / 3,
+        (profit_margin_norm + roe_norm + bep_norm) / 3,
+        debt_ratio_norm,
+    ]
+
+
+def random_rows(count, seed=1):
+    rng = np.random.default_rng(seed)
+    averages = np.array([industry_averages[name] for name in metric_names])
+    rows = rng.normal(1, 1, (count, len(metric_names))) * averages
+    # Zero DSO (not reported as a positive number) scores as the industry average
+    rows[rng.random(count) < 0.2, metric_names.index('Days Sales Outstanding')] = 0
+    return rows
+
+
+def test_matrix_matches_scalar_scoring():
+    rows = random_rows(2000)
+    expected = np.array([scalar_radar_scores(dict(zip(metric_names, row))) for row in rows])
+    np.testing.assert_allclose(radar_score_matrix(rows), expected, rtol=0, atol=1e-12)
+
+
+def test_wrapper_matches_matrix():
+    row = random_rows(1, seed=2)[0]
+    assert radar_scores(dict(zip(metric_names, row))) == pytest.approx(radar_score_matrix(row).tolist())
+
+
+def test_any_leading_shape():
+    rows = random_rows(24, seed=3)
+    np.testing.assert_allclose(radar_score_matrix(rows.reshape(2, 3, 4, -1)).reshape(24, -1), radar_score_matrix(rows))
+
+
+def test_nonpositive_dso_scores_as_industry_average():
+    row = np.array([industry_averages[name] for name in metric_names])
+    for dso in (0.0, -5.0):
+        row[metric_names.index('Days Sales Outstanding')] = dso
+        assert radar_score_matrix(row)[1] == pytest.approx(1.0)
+
+
+def test_missing_dso_is_left_out_of_efficiency():
+    row = np.array([industry_averages[name] for name in metric_names])
+    row[metric_names.index('Total Asset Turnover')] *= 2
+    row[metric_names.index('Days Sales Outstanding')] = np.nan
+    # Only the two turnover ratios are averaged: (1 + 2) / 2
+    assert radar_score_matrix(row)[1] == pytest.approx(1.5)
+
+
+def test_bank_ratios_that_do_not_apply():
+    row = np.array([industry_averages[name] for name in metric_names])
+    row[metric_names.index('Total Asset Turnover')] *= 0.05
+    for name in metric_packs['Banking']['not_applicable']:
+        row[metric_names.index(name)] = np.nan
+    liquidity, efficiency, profitability, solvency = radar_score_matrix(row)
+    assert np.isnan(liquidity)
+    assert efficiency == pytest.approx(0.05)
+    assert profitability == pytest.approx(1.0)
+    assert solvency == pytest.approx(1.0)
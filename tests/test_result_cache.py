@@ -0,0 +1,92 @@
+import os
+import struct
+
+import pytest
+
+from app import SharedResultCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SharedResultCache(str(tmp_path / 'cache.mmap'), slots=1, slot_bytes=4096, ttl=60)
+
+
+def slot_sequence(cache):
+    return cache.header.unpack_from(cache.mapping(), 0)[0]
+
+
+def test_set_and_get(cache):
+    assert cache.get('a') is None
+    assert cache.set('a', {'value': 1})
+    assert cache.get('a') == {'value': 1}
+    assert slot_sequence(cache) % 2 == 0
+
+
+def test_value_too_large_for_slot(cache):
+    assert not cache.set('a', os.urandom(8192))
+    assert cache.get('a') is None
+
+
+def test_torn_write_is_a_miss_and_the_slot_recovers(cache):
+    cache.set('a', 'old')
+    buffer = cache.mapping()
+
+    # A writer that died after marking the slot and overwriting part of the payload
+    sequence = slot_sequence(cache)
+    struct.pack_into('<Q', buffer, 0, sequence + 1)
+    buffer[cache.header.size:cache.header.size + 4] = b'\xff' * 4
+    assert cache.get('a') is None
+
+    assert cache.set('a', 'new')
+    assert slot_sequence(cache) % 2 == 0
+    assert cache.get('a') == 'new'
+
+
+def test_corrupted_payload_fails_the_crc(cache):
+    cache.set('a', 'value')
+    buffer = cache.mapping()
+    start = cache.header.size
+    buffer[start:start + 4] = bytes(b ^ 0xff for b in buffer[start:start + 4])
+    assert cache.get('a') is None
+
+
+def test_delete_and_reuse(cache):
+    cache.set('a', 1)
+    cache.delete('a')
+    assert cache.get('a') is None
+    assert slot_sequence(cache) % 2 == 0
+
+    cache.set('a', 2)
+    assert cache.get('a') == 2
+
+    # Deleting another key that maps to the same slot leaves the entry alone
+    cache.delete('b')
+    assert cache.get('a') == 2
+
+    # A colliding key replaces the entry
+    cache.set('b', 3)
+    assert cache.get('a') is None
+    assert cache.get('b') == 3
+
+
+def test_delete_after_torn_write(cache):
+    cache.set('a', 1)
+    struct.pack_into('<Q', cache.mapping(), 0, slot_sequence(cache) + 1)
+    cache.delete('a')
+    assert slot_sequence(cache) % 2 == 0
+    assert cache.get('a') is None
+    cache.set('a', 2)
+    assert cache.get('a') == 2
+
+
+def test_expired_entry_is_a_miss(cache):
+    cache.set('a', 1, ttl=-1)
+    assert cache.get('a') is None
+
+
+def test_shared_between_instances(tmp_path):
+    path = str(tmp_path / 'cache.mmap')
+    writer = SharedResultCache(path, slots=8, slot_bytes=4096)
+    reader = SharedResultCache(path, slots=8, slot_bytes=4096)
+    writer.set(('metrics', 'AAPL', 5, 'annual'), [1, 2, 3])
+    assert reader.get(('metrics', 'AAPL', 5, 'annual')) == [1, 2, 3]